@@ -1,17 +1,58 @@
 import os
-import re
 import json
+import time
 import threading
-import pandas as pd
-from difflib import get_close_matches
-from openai import OpenAI
 import tkinter as tk
 from tkinter import StringVar, Listbox, Scrollbar, Label, messagebox, Toplevel, Entry, Frame, Button
-from PIL import Image, ImageTk
 from tkinter.scrolledtext import ScrolledText
 import platform
 import subprocess
-import speech_recognition as sr
+from concurrent.futures import wait
+from property_parser import get_data_list, normalize_request, process_refinement, process_user_input
+from query_executor import QueryCancelled, QueryRejected, check_cancelled, get_query_executor
+from response_journal import ResponseJournal
+from tracing import TRACE_PATH, new_request_id, tracer
+from voice_engine import get_voice_engine
+
+STREAM_OUTPUT = True  # show cities and filters in the output area as the model produces them
+SPECULATIVE_PARSING = False  # opt-in: start parsing the input box before Submit (may call OpenAI on unfinished text)
+SPECULATION_DELAY_MS = 700  # typing pause before a speculative parse starts
+SPECULATION_POLL_SECONDS = 0.1  # how often a Submit waiting on a speculation checks for Cancel
+
+class Speculation:
+    """
+    A parse of the input box started before Submit, run on the shared query executor.
+    Newer text supersedes it: cancel() stops it if it is still queued or running.
+    """
+    def __init__(self, text, request_id):
+        self.text = text
+        self.key = normalize_request(text)
+        self.request_id = request_id
+        self.handle = get_query_executor().submit(self.run, request_id=request_id)
+
+    def run(self):
+        return process_user_input(get_data_list(), self.text, verbose=False)
+
+    def cancel(self):
+        self.handle.cancel()
+
+    def wait(self):
+        """
+        The speculative result, waiting for it if it is still running (None if it failed).
+        Called from the submitted query: if that query is cancelled meanwhile, the
+        speculation is cancelled with it.
+        """
+        while not wait([self.handle.future], timeout=SPECULATION_POLL_SECONDS).done:
+            try:
+                check_cancelled()
+            except Exception:
+                self.cancel()
+                raise
+        try:
+            return self.handle.result()
+        except Exception as e:
+            print(f"Speculative parse failed: {e}")
+            return None
 
 class SimpleYesNoDialog(Toplevel):
     def __init__(self, parent, title, prompt):
@@ -119,10 +160,10 @@ class VoiceEnabledDialog(Toplevel):
         self.prompt = prompt
         self.result = None
         self.is_multiline = is_multiline
-        self.recognizer = sr.Recognizer()
         self.is_listening = False
         self.recognized_text = ""
         self.listening_thread = None
+        self.trace_id = None
 
         if self.is_multiline:
             self.center_dialog(600, 300)
@@ -175,27 +216,20 @@ class VoiceEnabledDialog(Toplevel):
         self.cancel_button.config(state="normal")
         self.confirm_label.config(text="Listening...")
         self.recognized_text = ""
+        self.trace_id = new_request_id()
         self.listening_thread = threading.Thread(target=self.process_voice_input)
         self.listening_thread.start()
 
     def process_voice_input(self):
-        with sr.Microphone() as source:
-            self.recognizer.adjust_for_ambient_noise(source, duration=1)
-            while self.is_listening:
-                try:
-                    audio = self.recognizer.listen(source, timeout=5, phrase_time_limit=5)
-                    text = self.recognizer.recognize_google(audio)
-                    self.recognized_text += " " + text
-                    self.after(0, self.update_input_text, self.recognized_text.strip())
-                except sr.UnknownValueError:
-                    continue
-                except sr.RequestError:
-                    self.after(0, self.show_voice_error, "Error connecting to the speech recognition service.")
-                    break
-                except sr.WaitTimeoutError:
-                    continue
+        get_voice_engine().listen_microphone(
+            lambda: self.is_listening,
+            on_text=lambda text: self.after(0, self.update_input_text, text),
+            on_error=lambda message: self.after(0, self.show_voice_error, message),
+            request_id=self.trace_id
+        )
 
     def update_input_text(self, text):
+        self.recognized_text = text
         if self.is_multiline:
             self.input_widget.delete("1.0", tk.END)
             self.input_widget.insert(tk.END, text)
@@ -262,18 +296,25 @@ class PropertySearchGUI:
         self.master = master
         self.master.title("Property Search Assistant")
         self.center_window(650, 500)
-        self.all_results = []
+        self.journal = ResponseJournal()  # every result is appended to responses.jsonl as it arrives
         self.current_query = ""
-        self.recognizer = sr.Recognizer()
+        self.current_result = None  # last parsed result; "Add" refinements are merged into it
         self.is_listening = False
         self.recognized_text = ""  # For concatenating voice input
         self.listening_thread = None
+        self.trace_id = None  # request id for latency tracing, set when a voice query starts
+        self.speculation = None  # latest Speculation of the input box
+        self.speculation_timer = None
+        self.active_query = None  # QueryHandle of the submitted query, cancelled by the Cancel button
+        self.active_speculation = None  # the Speculation that query adopted, cancelled along with it
 
         self.instruction_label = tk.Label(master, text="Enter or speak your property search request:", font=("Arial", 12))
         self.instruction_label.pack(pady=5)
 
         self.input_text = tk.Text(master, height=4, width=80)
         self.input_text.pack(pady=5)
+        if SPECULATIVE_PARSING:
+            self.input_text.bind("<KeyRelease>", self.schedule_speculation)
 
         self.guidance_label = tk.Label(master, text="Edit query or click 'Submit' to confirm.", font=("Arial", 8), fg="gray")
         self.guidance_label.pack(pady=2)
@@ -300,8 +341,14 @@ class PropertySearchGUI:
         self.output_area.pack(pady=5)
         self.output_area.config(state="disabled")
 
-        self.copy_button = tk.Button(master, text="Copy to Clipboard", command=self.copy_to_clipboard)
-        self.copy_button.pack(pady=2)
+        self.bottom_frame = tk.Frame(master)
+        self.bottom_frame.pack(pady=2)
+
+        self.copy_button = tk.Button(self.bottom_frame, text="Copy to Clipboard", command=self.copy_to_clipboard)
+        self.copy_button.pack(side=tk.LEFT, padx=5)
+
+        self.export_button = tk.Button(self.bottom_frame, text="Export Responses", command=self.export_responses)
+        self.export_button.pack(side=tk.LEFT, padx=5)
 
     def center_window(self, width, height):
         self.master.update_idletasks()
@@ -338,29 +385,22 @@ class PropertySearchGUI:
         self.confirm_label.config(text="Listening...")
         self.set_output_text("Listening... Please speak your query.\n")
         self.recognized_text = ""  # Reset recognized text
+        self.trace_id = new_request_id()  # voice spans and the parse they lead to share this id
         self.listening_thread = threading.Thread(target=self.process_voice_input)
         self.listening_thread.start()
 
     def process_voice_input(self):
-        """Continuous listening in the main window's approach."""
-        with sr.Microphone() as source:
-            self.recognizer.adjust_for_ambient_noise(source, duration=1)
-            while self.is_listening:
-                try:
-                    audio = self.recognizer.listen(source, timeout=5, phrase_time_limit=5)
-                    text = self.recognizer.recognize_google(audio)
-                    self.recognized_text += " " + text  # Concatenate recognized text
-                    self.master.after(0, self.update_input_text, self.recognized_text.strip())
-                except sr.UnknownValueError:
-                    continue
-                except sr.RequestError:
-                    self.master.after(0, self.show_voice_error, "Error connecting to the speech recognition service.")
-                    break
-                except sr.WaitTimeoutError:
-                    continue
+        """Continuous listening; phrases are recognized in the background while the next one is captured."""
+        get_voice_engine().listen_microphone(
+            lambda: self.is_listening,
+            on_text=lambda text: self.master.after(0, self.update_input_text, text),
+            on_error=lambda message: self.master.after(0, self.show_voice_error, message),
+            request_id=self.trace_id
+        )
 
     def update_input_text(self, text):
-        """Updates the main text box with recognized text."""
+        """Updates the main text box with the recognized text so far."""
+        self.recognized_text = text
         self.input_text.delete("1.0", tk.END)
         self.input_text.insert(tk.END, text)
         self.set_output_text(f"Recognized: {text}\n", replace=True)
@@ -385,6 +425,8 @@ class PropertySearchGUI:
         self.cancel_button.config(state="disabled")
         self.confirm_label.config(text="")
         self.set_output_text("\nIs this correct?\n", replace=False)
+        if SPECULATIVE_PARSING:
+            self.speculate()  # parse while the user reviews the recognized text
 
     def on_cancel(self):
         self.is_listening = False
@@ -393,8 +435,57 @@ class PropertySearchGUI:
         self.done_button.config(state="disabled")
         self.cancel_button.config(state="disabled")
         self.confirm_label.config(text="")
+        if self.active_query:
+            # Stop the running query but keep the text so it can be edited and resubmitted.
+            self.active_query.cancel()
+            self.active_query = None
+            if self.active_speculation:
+                self.active_speculation.cancel()
+                self.active_speculation = None
+            self.set_output_text("Query cancelled.\n", replace=True)
+            return
         self.input_text.delete("1.0", tk.END)
         self.set_output_text("", replace=True)
+        self.drop_speculation()
+
+    def schedule_speculation(self, event=None):
+        """Debounces typing: speculate once the input has been unchanged for SPECULATION_DELAY_MS."""
+        if self.speculation_timer is not None:
+            self.master.after_cancel(self.speculation_timer)
+        self.speculation_timer = self.master.after(SPECULATION_DELAY_MS, self.speculate)
+
+    def speculate(self):
+        """Starts parsing the input box in the background, superseding any older speculation."""
+        self.speculation_timer = None
+        if self.is_listening:
+            return  # wait for on_done
+        text = self.input_text.get("1.0", tk.END).strip()
+        if not text or text == "Is this correct?":
+            return
+        if self.speculation and self.speculation.key == normalize_request(text):
+            return
+        self.drop_speculation()
+        try:
+            self.speculation = Speculation(text, self.trace_id or new_request_id())
+        except QueryRejected:
+            pass  # the executor is busy; Submit will parse as usual
+
+    def drop_speculation(self):
+        if self.speculation_timer is not None:
+            self.master.after_cancel(self.speculation_timer)
+            self.speculation_timer = None
+        if self.speculation:
+            self.speculation.cancel()
+            self.speculation = None
+
+    def take_speculation(self, text):
+        """The current speculation if it parsed exactly this text (after normalization), else None."""
+        speculation, self.speculation = self.speculation, None
+        if speculation and speculation.key == normalize_request(text):
+            return speculation
+        if speculation:
+            speculation.cancel()
+        return None
 
     def on_submit(self):
         """When user clicks Submit (final)."""
@@ -403,42 +494,95 @@ class PropertySearchGUI:
             messagebox.showwarning("Input Error", "Please edit the query or type 'Yes' to confirm before submitting.")
             return
         self.current_query = user_input
+        self.start_query(user_input, "Processing, please wait...\n", speculation=self.take_speculation(user_input))
+
+    def submit_refinement(self, refinement):
+        """Sends only the refinement text, merged into the current result (see process_refinement)."""
+        self.current_query = self.current_query + " " + refinement
+        self.input_text.delete("1.0", tk.END)
+        self.input_text.insert(tk.END, self.current_query)
+        self.start_query(refinement, "Refining, please wait...\n", prior=self.current_result)
+
+    def start_query(self, user_input, status, prior=None, speculation=None):
         self.submit_button.config(state="disabled")
         self.speak_button.config(state="disabled")
         self.done_button.config(state="disabled")
-        self.cancel_button.config(state="disabled")
+        self.cancel_button.config(state="normal")  # Cancel stops the query
         self.confirm_label.config(text="")
-        self.set_output_text("Processing, please wait...\n", replace=True)
+        self.set_output_text(status, replace=True)
 
-        thread = threading.Thread(target=self.run_query, args=(self.current_query,))
-        thread.start()
-
-    def run_query(self, user_input):
-        """Calls process_user_input, then calls update_output with the results."""
-        results = []
+        request_id = speculation.request_id if speculation else self.trace_id or new_request_id()
+        self.trace_id = None
         try:
-            result = process_user_input(data_list, user_input)
-            if result:
-                results.append(result)
+            handle = get_query_executor().submit(
+                self.run_query, user_input, request_id, time.perf_counter(), prior, speculation, request_id=request_id
+            )
+        except QueryRejected as e:
+            print(f"Could not start query: {e}")
+            self.update_output([], request_id)
+            return
+        self.active_query = handle
+        self.active_speculation = speculation
+        handle.add_done_callback(lambda handle: self.master.after(0, self.finish_query, handle, request_id))
+
+    def run_query(self, user_input, request_id=None, submitted_at=None, prior=None, speculation=None):
+        """Runs on the query executor: calls process_user_input (or process_refinement) and returns the result."""
+        if submitted_at is not None:
+            tracer.record("gui.dispatch", time.perf_counter() - submitted_at, request_id, submitted_at)
+        # A speculation of the same text is usually finished by the time Submit is clicked.
+        result = speculation.wait() if speculation else None
+        if result is None and prior is not None:
+            result = process_refinement(get_data_list(), prior, user_input)
+        elif result is None:
+            result = process_user_input(
+                get_data_list(), user_input,
+                on_city=lambda cities: self.master.after(0, self.show_partial_cities, cities),
+                on_filter=lambda filter_row: self.master.after(0, self.show_partial_filter, filter_row)
+            ) if STREAM_OUTPUT else process_user_input(get_data_list(), user_input)
+        return result
+
+    def finish_query(self, handle, request_id):
+        """Back on the Tk thread once the executor is done with the query (or gave up on it)."""
+        if handle is not self.active_query:
+            return  # cancelled; on_cancel already reset the window
+        self.active_query = None
+        self.active_speculation = None
+        try:
+            result = handle.result()
+        except QueryCancelled:
+            return
         except Exception as e:
-            self.master.after(0, self.set_output_text, f"Unexpected error: {str(e)}\n", True)
-        self.master.after(0, self.update_output, results)
+            print(f"Query failed: {type(e).__name__}: {e}")
+            result = None
+        self.update_output([result] if result else [], request_id)
+
+    def show_partial_cities(self, cities):
+        """Streaming: the city list is complete while the filters are still generating."""
+        self.set_output_text(f"Cities: {json.dumps(cities)}\nFilters so far:\n", replace=True)
 
-    def update_output(self, result):
+    def show_partial_filter(self, filter_row):
+        """Streaming: shows each filter as soon as the model has finished writing it."""
+        self.set_output_text(json.dumps(filter_row, indent=4) + "\n", replace=False)
+
+    def update_output(self, result, request_id=None):
         """Called after we get the parse result from GPT."""
-        self.submit_button.config(state="normal")
-        self.speak_button.config(state="normal")
-        self.done_button.config(state="disabled")
-        self.cancel_button.config(state="disabled")
-        self.confirm_label.config(text="")
+        with tracer.span("gui.render", request_id):
+            self.submit_button.config(state="normal")
+            self.speak_button.config(state="normal")
+            self.done_button.config(state="disabled")
+            self.cancel_button.config(state="disabled")
+            self.confirm_label.config(text="")
+
+            if result:
+                formatted_result = json.dumps(result, indent=4)
+                self.set_output_text(formatted_result, replace=True)
+                self.journal.append(result)
+                self.current_result = result[0]
+                self.drop_speculation()
+            else:
+                self.set_output_text("Error processing the query. Check console for details.", replace=True)
+            self.master.update_idletasks()
 
-        if result:
-            formatted_result = json.dumps(result, indent=4)
-            self.set_output_text(formatted_result, replace=True)
-            self.all_results.append(result)
-        else:
-            self.set_output_text("Error processing the query. Check console for details.", replace=True)
-        
         self.followup_loop()
 
     def followup_loop(self):
@@ -451,7 +595,9 @@ class PropertySearchGUI:
         add_or_new = ask_add_new(self.master, "Query Option", "Add to current query or start new?")
         if add_or_new == "add":
             refinement = voice_ask_string("Add Refinement", "What would you like to add to your current query?", self.master, is_multiline=True)
-            if refinement:
+            if refinement and self.current_result:
+                self.submit_refinement(refinement)
+            elif refinement:
                 self.current_query = self.current_query + " " + refinement
                 self.input_text.delete("1.0", tk.END)
                 self.input_text.insert(tk.END, self.current_query)
@@ -460,103 +606,22 @@ class PropertySearchGUI:
                 self.input_text.delete("1.0", tk.END)
         elif add_or_new == "new":
             self.current_query = ""
+            self.current_result = None
+            self.drop_speculation()
             self.input_text.delete("1.0", tk.END)
             self.set_output_text("", replace=True)
         else:
             tk.messagebox.showinfo("Info", "No recognized option. Keeping current state.")
 
-    def save_responses(self):
-        """Save all collected results to JSON."""
+    def export_responses(self):
+        """Writes this session's results from the journal to all_responses.json and opens it."""
         try:
-            with open("all_responses.json", "w") as f:
-                json.dump(self.all_results, f, indent=4)
-            self.set_output_text("\nAll responses saved to all_responses.json.", replace=False)
+            count = self.journal.export("all_responses.json", session=self.journal.session)
+            self.set_output_text(f"\n{count} responses saved to all_responses.json.", replace=False)
         except Exception as e:
             self.set_output_text(f"\nError saving responses: {str(e)}", replace=False)
-
-def load_excel_as_dicts(filename, sheet="Sheet1"):
-    df = pd.read_excel(filename, sheet_name=sheet)
-    required_columns = ["filter_category", "filter_name", "table_name", "column_name", "search_type"]
-    df = df.dropna(subset=required_columns)
-    row_dicts = []
-    for _, row in df.iterrows():
-        row_dict = {
-            "filter_category": None if pd.isna(row["filter_category"]) else row["filter_category"],
-            "filter_name": None if pd.isna(row["filter_name"]) else row["filter_name"],
-            "table_name": None if pd.isna(row["table_name"]) else row["table_name"],
-            "column_name": None if pd.isna(row["column_name"]) else row["column_name"],
-            "column_value": None if pd.isna(row.get("column_value", None)) else row.get("column_value", None),
-            "field_name": None if pd.isna(row.get("field_name", None)) else row.get("field_name", None),
-            "search_type": None if pd.isna(row["search_type"]) else row["search_type"]
-        }
-        row_dicts.append(row_dict)
-    return row_dicts
-
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-data_list = load_excel_as_dicts("filter_data.xlsx")
-
-def process_user_input(data, user_input):
-    parsed_data = parse_request_with_openai(data, user_input)
-    if not parsed_data:
-        print("\nError: Could not process user request.")
-        return None
-
-    print(json.dumps(parsed_data, indent=2))
-    return parsed_data
-
-def parse_request_with_openai(data, request):
-    context_text = json.dumps(data, indent=2)
-    prompt = f"""
-Here is a dataset represented as a list of dictionaries:
-{context_text}
-
-From the following user request, please perform the following tasks:
-1. Extract all city names mentioned in the request.
-2. "filter_name": extract the filter name from the user query.
-3. "values": the numeric range (e.g., [min, max]) or single value extracted (e.g., [value]).
-4. Search the dataset to find the row that most closely matches the extracted filter name.
-
-IMPORTANT:
-- filter_category, filter_name, table_name, column_name, column_value, field_name should match the row exactly.
-- If the row's search_type is 'min_max', handle numeric min/max. Use null if no lower or upper bound is mentioned.
-- If the row's search_type is "Yes/No", set 'value' to 'True' for yes and 'False' for no
-- If the row's search_type is NOT 'min_max', set 'search_type' to null in the final JSON (DO NOT keep the row's original search_type).
-- If the user references something relevant (like 'University of Texas'), place it in 'value'.
-
-NOTE ABOUT MULTIPLE FILTERS:
-- If the user request contains multiple constraints (e.g., "at least 500 units and 1000 sqft"),
-  return multiple objects in the "filters" array—one object per constraint.
-
-If there are no constraints, just return the city with an empty "filters" array.
-
-Return a JSON object with the following structure (valid JSON only):
-
-{{
-  "city": [ ... ],
-  "filters": [
-    {{
-      "filter_category": "...",
-      "filter_name": "...",
-      "table_name": "...",
-      "column_name": "...",
-      "column_value": "...",
-      "field_name": "...",
-      "search_type": "...",
-      "value": [...]
-    }}
-  ]
-}}
-
-User Request: "{request}"
-""".strip()
-
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.2,
-        response_format={"type": "json_object"}
-    )
-    return json.loads(response.choices[0].message.content)
+            return
+        open_file("all_responses.json")
 
 def open_file(filepath):
     if platform.system() == 'Darwin':
@@ -567,13 +632,17 @@ def open_file(filepath):
         subprocess.call(('xdg-open', filepath))
 
 def on_closing(root, app):
-    app.save_responses()
-    if os.path.exists("all_responses.json"):
-        open_file("all_responses.json")
+    app.journal.close()  # results are already on disk; this only waits for the last batch
+    if tracer.enabled:
+        try:
+            tracer.dump(TRACE_PATH)
+        except OSError as e:
+            print(f"Could not write {TRACE_PATH}: {e}")
     root.destroy()
 
 if __name__ == "__main__":
     root = tk.Tk()
     app = PropertySearchGUI(root)
+    threading.Thread(target=get_data_list, daemon=True).start()  # warm the catalog while the window opens
     root.protocol("WM_DELETE_WINDOW", lambda: on_closing(root, app))
     root.mainloop()
\ No newline at end of file
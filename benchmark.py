@@ -0,0 +1,212 @@
+"""
+Offline benchmark for the parsing pipeline.
+
+Starts stub_openai_server.py in-process with configurable latency and jitter, builds
+synthetic catalogs by scaling filter_data.xlsx up to each requested size, and runs a
+fixed query mix through process_user_input with a pool of client threads. Each catalog
+size runs in a fresh interpreter so startup time and peak memory are measured cleanly.
+
+    python benchmark.py                          # 1k, 10k and 100k rows, compare to baseline
+    python benchmark.py --scales 1000 --queries 100 --latency 0.2 --jitter 0.1
+    python benchmark.py --scales 1000 --no-fast-path --slow-rate 0.05 --slow-latency 3 --hedge
+    python benchmark.py --scales 1000 --no-fast-path --concurrency 32 --batch-size 8 --batch-window-ms 30
+    python benchmark.py --save-baseline          # store this run as benchmark_baseline.json
+
+Reported per catalog size: queries/sec, latency p50/p95/p99, average prompt bytes sent
+upstream, upstream calls, peak RSS, and startup time split into module import, catalog
+load, index build and OpenAI client creation.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+DEFAULT_SCALES = [1000, 10000, 100000]
+# Half of these are handled by the fast path, half need the model.
+QUERY_MIX = [
+    "Properties in Austin with at least 100 units but no more than 200",
+    "Properties in Atlanta with no more than 10000 square feet but at least 8000 square feet",
+    "Properties in Chicago owned by Bob Jones Company",
+    "Properties in Dallas, Fort Worth, and Coppell near Texas Christian University and Southern Methodist University",
+    "Class A properties in Phoenix with low crime and good schools",
+    "Properties in Seattle with rent growth above 5% and occupancy of at least 92%",
+    "Affordable buildings in Miami close to transit with high walkability",
+    "Properties in Denver where median income is over 80000 and unemployment is low",
+]
+# Lower is better for everything except throughput.
+HIGHER_IS_BETTER = {"qps"}
+
+def synthetic_catalog(rows, size):
+    """Repeats the real catalog up to `size` rows, making each copy's filter names unique."""
+    catalog = []
+    for i in range(size):
+        row = dict(rows[i % len(rows)])
+        generation = i // len(rows)
+        if generation:
+            row["filter_name"] = f"{row['filter_name']} v{generation}"
+        catalog.append(row)
+    return catalog
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+def run_scale(size, queries, concurrency, fast_path, hedge=False, batch_size=0, batch_window_ms=30):
+    """Runs in the worker interpreter; returns the metrics dict for one catalog size."""
+    started = time.perf_counter()
+    import property_parser
+    from hedging import get_hedge_policy
+    imported = time.perf_counter()
+    from concurrent.futures import ThreadPoolExecutor
+    import resource
+
+    property_parser.PARSE_CACHE_ENABLED = False
+    property_parser.FAST_PATH_ENABLED = fast_path
+    property_parser.HEDGE_ENABLED = hedge
+    property_parser.BATCHING_ENABLED = batch_size > 1
+    property_parser.BATCH_MAX_SIZE = batch_size
+    property_parser.BATCH_WINDOW_SECONDS = batch_window_ms / 1000
+    base_rows = property_parser.get_data_list()
+    loaded = time.perf_counter()
+    rows = synthetic_catalog(base_rows, size)
+    index_started = time.perf_counter()
+    catalog = property_parser.CatalogSnapshot(rows)
+    indexed = time.perf_counter()
+    property_parser.get_client()  # importing openai is part of startup, not of the first query
+    client_ready = time.perf_counter()
+
+    workload = [QUERY_MIX[i % len(QUERY_MIX)] for i in range(queries)]
+    latencies = []
+    errors = 0
+
+    def one(query):
+        start = time.perf_counter()
+        result = property_parser.process_user_input(catalog, query, verbose=False)
+        return time.perf_counter() - start, result
+
+    run_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for seconds, result in pool.map(one, workload):
+            latencies.append(seconds)
+            errors += result is None
+    elapsed = time.perf_counter() - run_started
+    latencies.sort()
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "catalog_rows": size,
+        "queries": queries,
+        "errors": errors,
+        "qps": round(queries / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "import_ms": round((imported - started) * 1000, 2),
+        "catalog_load_ms": round((loaded - imported) * 1000, 2),
+        "index_build_ms": round((indexed - index_started) * 1000, 2),
+        "client_init_ms": round((client_ready - indexed) * 1000, 2),
+        "peak_rss_mb": round(rss_kb / 1024 if sys.platform != "darwin" else rss_kb / 1024 / 1024, 1),
+        "upstream_calls": property_parser.token_usage.stats()["requests"],
+        "hedging": get_hedge_policy().stats() if hedge else None,
+        "batching": property_parser.get_parse_batcher().stats() if batch_size > 1 else None
+    }
+
+def run_worker(size, args, base_url):
+    env = dict(os.environ, OPENAI_BASE_URL=base_url, OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY") or "stub")
+    command = [
+        sys.executable, os.path.abspath(__file__), "--worker", str(size),
+        "--queries", str(args.queries), "--concurrency", str(args.concurrency)
+    ]
+    if args.no_fast_path:
+        command.append("--no-fast-path")
+    if args.hedge:
+        command.append("--hedge")
+    if args.batch_size > 1:
+        command += ["--batch-size", str(args.batch_size), "--batch-window-ms", str(args.batch_window_ms)]
+    output = subprocess.run(command, env=env, capture_output=True, text=True)
+    if output.returncode != 0:
+        raise RuntimeError(f"worker for {size} rows failed:\n{output.stderr}")
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def compare(results, baseline):
+    """Prints each metric next to the stored baseline for the same catalog size."""
+    by_size = {r["catalog_rows"]: r for r in baseline.get("results", [])}
+    for result in results:
+        old = by_size.get(result["catalog_rows"])
+        if not old:
+            continue
+        print(f"\nvs baseline ({baseline.get('recorded', 'unknown date')}), {result['catalog_rows']} rows:")
+        for metric in ("qps", "p50_ms", "p95_ms", "p99_ms", "prompt_bytes", "peak_rss_mb", "import_ms", "index_build_ms", "client_init_ms"):
+            if metric not in old or not old[metric]:
+                continue
+            change = (result[metric] - old[metric]) / old[metric]
+            better = change > 0 if metric in HIGHER_IS_BETTER else change < 0
+            marker = "better" if better and abs(change) >= 0.05 else "worse" if abs(change) >= 0.05 else "same"
+            print(f"  {metric:<15} {old[metric]:>10} -> {result[metric]:>10}  ({change:+.0%}, {marker})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the parser against a local stub OpenAI server.")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES, help="synthetic catalog sizes")
+    parser.add_argument("--queries", type=int, default=200, help="queries per catalog size")
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads")
+    parser.add_argument("--latency", type=float, default=0.5, help="stub completion latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.2, help="uniform +/- jitter on the stub latency")
+    parser.add_argument("--no-fast-path", action="store_true", help="send every query to the stub")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of stub completions that are slow")
+    parser.add_argument("--slow-latency", type=float, default=3.0, help="seconds a slow stub completion takes")
+    parser.add_argument("--hedge", action="store_true", help="hedge slow upstream calls (see hedging.py)")
+    parser.add_argument("--batch-size", type=int, default=0, help="micro-batch up to this many requests per call (0: off)")
+    parser.add_argument("--batch-window-ms", type=float, default=30, help="how long a batch waits to fill up")
+    parser.add_argument("--batch-item-latency", type=float, default=0.0, help="stub seconds added per extra batched request")
+    parser.add_argument("--save-baseline", action="store_true", help=f"write results to {os.path.basename(BASELINE_PATH)}")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_scale(args.worker, args.queries, args.concurrency, not args.no_fast_path, args.hedge,
+                                    args.batch_size, args.batch_window_ms)))
+        return
+
+    from stub_openai_server import start_stub_server
+    results = []
+    for size in args.scales:
+        stub = start_stub_server(latency=args.latency, jitter=args.jitter, seed=size,
+                                 slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                                 batch_item_latency=args.batch_item_latency)
+        result = run_worker(size, args, stub.base_url)
+        stats = stub.state.stats()
+        result["prompt_bytes"] = round(stats["prompt_bytes"] / stats["completions"]) if stats["completions"] else 0
+        result["prompt_bytes_per_query"] = round(stats["prompt_bytes"] / args.queries)
+        stub.shutdown()
+        results.append(result)
+        print(
+            f"{size:>7} rows: {result['qps']:>7} q/s  p50 {result['p50_ms']:>8}ms  p95 {result['p95_ms']:>8}ms  "
+            f"p99 {result['p99_ms']:>8}ms  prompt {result['prompt_bytes']:>6}B  upstream {result['upstream_calls']:>4}  "
+            f"rss {result['peak_rss_mb']:>6}MB  import {result['import_ms']:>6}ms  index {result['index_build_ms']:>9}ms"
+            + (f"  errors {result['errors']}" if result["errors"] else "")
+        )
+        if result.get("hedging"):
+            hedging = result["hedging"]
+            print(f"         hedged {hedging['hedged']}/{hedging['calls']} calls ({hedging['hedge_rate']:.1%}), "
+                  f"hedge won {hedging['win_rate']:.0%}, held back by budget {hedging['budget_denied']} "
+                  f"and gate {hedging['gate_denied']}, hedge after "
+                  + ", ".join(f"{ms}ms ({kind})" for kind, ms in hedging["hedge_after_ms"].items()))
+        if result.get("batching"):
+            batching = result["batching"]
+            print(f"         {batching['batches']} batches, avg size {batching['avg_batch_size']:.1f}, "
+                  f"{batching['unanswered']} retried alone, prompt {result['prompt_bytes_per_query']}B per query")
+
+    if os.path.exists(BASELINE_PATH) and not args.save_baseline:
+        with open(BASELINE_PATH) as f:
+            compare(results, json.load(f))
+    if args.save_baseline:
+        settings = {k: getattr(args, k) for k in ("queries", "concurrency", "latency", "jitter", "no_fast_path", "slow_rate", "slow_latency", "hedge",
+                                                "batch_size", "batch_window_ms", "batch_item_latency")}
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({"recorded": time.strftime("%Y-%m-%d"), "settings": settings, "results": results}, f, indent=4)
+        print(f"\nBaseline written to {BASELINE_PATH}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Headless bulk mode: push a JSONL file of saved search phrases through process_user_input.
+
+Each input line is either a JSON object with an "id" and a "query" (or "request"/"text")
+field, a bare JSON string, or plain text. Lines without an id get their 1-based line
+number as id. Results are written as JSONL, one {"id", "query", "result", "error"}
+object per input line:
+
+    python bulk_parse.py queries.jsonl -o results.jsonl --workers 16 --max-rps 20
+    cat queries.jsonl | python bulk_parse.py - --ordered > results.jsonl
+
+With --resume, ids that already have a result in the output file are skipped and new
+results are appended, so an interrupted batch can be restarted with the same command.
+Lines that recorded an error are removed from the file first and their ids run again. Queries run on a
+QueryExecutor, so each one has a deadline (--timeout) and transient OpenAI errors are
+retried with backoff (--retries).
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+from property_parser import RateLimiter, get_data_list, process_user_input, token_usage
+from query_executor import QUERY_MAX_RETRIES, QUERY_TIMEOUT_SECONDS, QueryExecutor
+from tracing import tracer
+
+QUERY_FIELDS = ("query", "request", "text")
+
+def read_queries(stream):
+    """Yields (id, query) pairs from a JSONL stream, skipping blank lines."""
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError:
+            item = line
+        if isinstance(item, dict):
+            query = next((item[f] for f in QUERY_FIELDS if item.get(f)), None)
+            query_id = item.get("id", line_number)
+        else:
+            query, query_id = str(item), line_number
+        yield query_id, query
+
+def load_done_ids(path):
+    """
+    Ids that already have a successful result line in an existing output file. Lines with
+    an error, lines cut short by a crash and repeats of a done id are removed from the file,
+    so the failed ids are run again and every id ends up with one final line.
+    """
+    done = set()
+    if not path or path == "-" or not os.path.exists(path):
+        return done
+    kept, dropped = [], 0
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                query_id, error = record["id"], record.get("error")
+            except (json.JSONDecodeError, KeyError, TypeError, AttributeError):
+                dropped += 1
+                continue
+            if error is not None or query_id in done:
+                dropped += 1
+                continue
+            done.add(query_id)
+            kept.append(line if line.endswith("\n") else line + "\n")
+    if dropped:
+        with open(path + ".tmp", "w") as f:
+            f.writelines(kept)
+        os.replace(path + ".tmp", path)
+        print(f"Resume: {len(done)} done, {dropped} failed or incomplete lines removed to be rerun", file=sys.stderr)
+    return done
+
+def make_record(query_id, query, handle):
+    """The output line for one query, from its finished QueryHandle (None if the query was empty)."""
+    record = {"id": query_id, "query": query, "result": None, "error": None}
+    if handle is None:
+        record["error"] = "missing query"
+        return record
+    try:
+        record["result"] = handle.result()
+        if record["result"] is None:
+            record["error"] = "could not process request"
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    return record
+
+class ResultWriter:
+    """Writes records as they finish, or buffers them to restore input order."""
+    def __init__(self, out, ordered):
+        self.out = out
+        self.ordered = ordered
+        self.pending = {}
+        self.next_seq = 0
+        self.lock = threading.Lock()
+        self.written = 0
+        self.errors = 0
+
+    def write(self, seq, record):
+        with self.lock:
+            if not self.ordered:
+                self.emit(record)
+                return
+            self.pending[seq] = record
+            while self.next_seq in self.pending:
+                self.emit(self.pending.pop(self.next_seq))
+                self.next_seq += 1
+
+    def emit(self, record):
+        self.out.write(json.dumps(record) + "\n")
+        self.out.flush()
+        self.written += 1
+        if record["error"]:
+            self.errors += 1
+
+def run_bulk(queries, out, workers=8, max_rps=None, ordered=False, done_ids=(), progress_every=100,
+             timeout=QUERY_TIMEOUT_SECONDS, retries=QUERY_MAX_RETRIES):
+    data = get_data_list()
+    rate_limiter = RateLimiter(max_rps, burst=workers) if max_rps else None
+    writer = ResultWriter(out, ordered)
+    # A queue of one batch per worker keeps memory flat on huge inputs; submit() blocks when it is full.
+    executor = QueryExecutor(workers=workers, max_queue=workers, timeout=timeout, max_retries=retries)
+    skipped = 0
+    started = time.perf_counter()
+    all_done = threading.Condition()
+    pending = [0]
+
+    def finish(seq, query_id, query, handle):
+        writer.write(seq, make_record(query_id, query, handle))
+        if progress_every and writer.written % progress_every == 0:
+            rate = writer.written / (time.perf_counter() - started)
+            print(f"{writer.written} done, {writer.errors} errors, {rate:.1f} queries/s", file=sys.stderr)
+        with all_done:
+            pending[0] -= 1
+            all_done.notify_all()
+
+    seq = 0
+    for query_id, query in queries:
+        if query_id in done_ids:
+            skipped += 1
+            continue
+        with all_done:
+            pending[0] += 1
+        if not query:
+            finish(seq, query_id, query, None)
+        else:
+            handle = executor.submit(process_user_input, data, query, rate_limiter=rate_limiter, verbose=False,
+                                     request_id=query_id, block=True)
+            handle.add_done_callback(lambda h, s=seq, i=query_id, q=query: finish(s, i, q, h))
+        seq += 1
+    with all_done:
+        all_done.wait_for(lambda: pending[0] == 0)
+    executor.pool.shutdown()
+
+    elapsed = time.perf_counter() - started
+    tokens = token_usage.stats()
+    stats = executor.stats()
+    print(
+        f"Finished: {writer.written} processed, {skipped} skipped, {writer.errors} errors in {elapsed:.1f}s; "
+        f"{tokens['requests']} OpenAI calls, {tokens['prompt_tokens']} prompt / {tokens['completion_tokens']} completion tokens; "
+        f"{stats['retries']} retries, {stats['timed_out']} timed out",
+        file=sys.stderr
+    )
+    return writer.written, skipped, writer.errors
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parse a JSONL file of property search requests.")
+    parser.add_argument("input", help="JSONL file of queries, or - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="JSONL file for results (default: stdout)")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent queries (default: 8)")
+    parser.add_argument("--max-rps", type=float, default=None, help="cap on OpenAI requests per second")
+    parser.add_argument("--ordered", action="store_true", help="write results in input order")
+    parser.add_argument("--resume", action="store_true", help="skip ids already answered in the output file, rerun failed ones and append")
+    parser.add_argument("--timeout", type=float, default=QUERY_TIMEOUT_SECONDS, help="seconds allowed per query, retries included")
+    parser.add_argument("--retries", type=int, default=QUERY_MAX_RETRIES, help="retries on transient OpenAI errors")
+    parser.add_argument("--trace-out", help="write per-stage latency percentiles and spans to this JSON file")
+    args = parser.parse_args(argv)
+
+    done_ids = load_done_ids(args.output) if args.resume else set()
+    source = sys.stdin if args.input == "-" else open(args.input)
+    if args.output == "-":
+        out = sys.stdout
+    else:
+        out = open(args.output, "a" if args.resume else "w")
+    try:
+        _, _, errors = run_bulk(
+            read_queries(source), out, args.workers, args.max_rps, args.ordered, done_ids,
+            timeout=args.timeout, retries=args.retries
+        )
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+        if args.trace_out:
+            tracer.dump(args.trace_out)
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
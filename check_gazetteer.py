@@ -0,0 +1,64 @@
+"""
+City extraction check for gazetteer.py against the bundled us_places.txt (offline).
+
+Runs Gazetteer.extract() over requests whose cities it must read itself, and over
+requests it must hand to the model (complete=False): places missing from the list,
+known names that are only the start of a longer place ("Mission Viejo",
+"Dallas-Fort Worth") and place names used as ordinary words. Exits non-zero when a
+check fails:
+
+    python check_gazetteer.py
+"""
+import sys
+
+from gazetteer import get_gazetteer
+
+# request -> cities read locally (the list is complete)
+LOCAL = {
+    "Properties in Dallas, Fort Worth, and Coppell": ["Dallas", "Fort Worth", "Coppell"],
+    "Properties in Boston and Cambridge": ["Boston", "Cambridge"],
+    "Properties in Kansas City": ["Kansas City"],
+    "Properties in Salt Lake City, UT": ["Salt Lake City"],
+    "Properties in Austin, TX with a pool": ["Austin"],
+    "Properties in Austin TX": ["Austin"],
+    "Properties in Portland Oregon": ["Portland"],
+    "Properties in Austin With pools": ["Austin"],
+    "properties in st. louis": ["St. Louis"],
+    "Austin apartments": ["Austin"],
+    "Dallas and Fort Worth": ["Dallas", "Fort Worth"],
+}
+
+# requests whose cities the gazetteer must not claim to know
+INCOMPLETE = [
+    "Properties in Mission Viejo",
+    "Properties in Dallas-Fort Worth",
+    "Properties in Santa Fe Springs",
+    "Properties in Columbia Heights with a pool",
+    "Properties in Spring Valley",
+    "Mission Viejo apartments",
+    "Properties in Dallas and Smallville",
+    "Properties in Smallville",
+    "Mobile home parks",
+    "Surprise me with deals in Texas",
+    "Orange County properties",
+]
+
+def main():
+    gazetteer = get_gazetteer()
+    failures = []
+
+    def check(ok, message):
+        print(f"{'ok  ' if ok else 'FAIL'} {message}")
+        if not ok:
+            failures.append(message)
+
+    for request, expected in LOCAL.items():
+        cities, _, complete = gazetteer.extract(request)
+        check(complete and cities == expected, f"{request!r} -> {cities} (complete={complete})")
+    for request in INCOMPLETE:
+        cities, _, complete = gazetteer.extract(request)
+        check(not complete, f"{request!r} goes to the model (got {cities}, complete={complete})")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
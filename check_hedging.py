@@ -0,0 +1,97 @@
+"""
+Behaviour check for hedging.py against the local stub API (no network, no API spend).
+
+Starts stub_openai_server in a thread with a share of stalled completions and sends
+OpenAI calls through property_parser.create_completion with hedging on. Checks that
+duplicates stay within the hedge budget, that the duplicate usually wins against a
+stalled call, that the losing attempt is closed before it finishes, that streamed and
+non-streamed calls keep separate latency windows, and that no duplicate is sent while
+the upstream gate is full. Exits non-zero when a check fails:
+
+    python check_hedging.py
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import property_parser
+from hedging import HEDGE_BUDGET, HEDGE_BURST, get_hedge_policy
+from property_parser import UpstreamGate, create_completion
+from stub_openai_server import start_stub_server
+
+STUB_LATENCY = 0.2
+SLOW_RATE = 0.04  # below the 5% the p95 skips, so the hedge delay tracks the normal latency
+SLOW_LATENCY = 2.0
+CALLS = 200
+CONCURRENCY = 16
+GATE_CALLS = 20
+GATE_SLOW_RATE = 0.25  # stall more often while calling one at a time, so the gate is tested in a few calls
+MESSAGES = [{"role": "user", "content": "Properties near good coffee"}]
+
+def complete(gate=None):
+    response = create_completion(gate, model=property_parser.OPENAI_MODEL, messages=MESSAGES,
+                                 response_format={"type": "json_object"})
+    return response.choices[0].message.content
+
+def stream(gate=None):
+    response = create_completion(gate, model=property_parser.OPENAI_MODEL, messages=MESSAGES, stream=True)
+    return "".join(chunk.choices[0].delta.content or "" for chunk in response if chunk.choices)
+
+def main():
+    stub = start_stub_server(latency=STUB_LATENCY, seed=7, slow_rate=SLOW_RATE, slow_latency=SLOW_LATENCY)
+    os.environ["OPENAI_BASE_URL"] = stub.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    property_parser.HEDGE_ENABLED = True
+    policy = get_hedge_policy()
+    failures = []
+
+    def check(ok, message):
+        print(f"{'ok  ' if ok else 'FAIL'} {message}")
+        if not ok:
+            failures.append(message)
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        answers = list(pool.map(lambda _: complete(), range(CALLS))) + list(pool.map(lambda _: stream(), range(CALLS)))
+    check(all(answer == answers[0] and answer for answer in answers), f"all {len(answers)} calls were answered")
+
+    stats = policy.stats()
+    allowed = HEDGE_BUDGET * stats["calls"] + HEDGE_BURST
+    check(0 < stats["hedged"] <= allowed, f"{stats['hedged']} duplicates for {stats['calls']} calls (budget {allowed:.0f})")
+    check(stats["win_rate"] >= 0.75, f"the duplicate won {stats['win_rate']:.0%} of hedges against stalled calls")
+    check(set(stats["samples"]) == {"complete", "stream"}, f"streamed and non-streamed calls have separate windows {stats['samples']}")
+    after = stats["hedge_after_ms"]
+    check(after["stream"] < after["complete"],
+          f"a stream is hedged on its first chunk ({after['stream']}ms), a full answer later ({after['complete']}ms)")
+
+    deadline = time.monotonic() + SLOW_LATENCY + 2
+    while stub.state.stats()["in_flight"] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    losers = stats["hedged"] - stats["errors"]
+    closed = stub.state.stats()["closed_early"]
+    check(closed >= 0.8 * losers, f"losing attempts were closed before finishing ({closed} of {losers})")
+
+    stub.state.slow_rate = GATE_SLOW_RATE
+    gate = UpstreamGate(1)
+    hedged = policy.stats()["hedged"]
+    denied = policy.stats()["gate_denied"]
+    for _ in range(GATE_CALLS):
+        with gate:
+            complete(gate)
+    stats = policy.stats()
+    check(stats["hedged"] == hedged and stats["gate_denied"] > denied,
+          f"no duplicate is sent while the gate is full ({stats['gate_denied'] - denied} held back)")
+
+    gate = UpstreamGate(2)
+    for _ in range(GATE_CALLS):
+        with gate:
+            complete(gate)
+    deadline = time.monotonic() + SLOW_LATENCY + 2
+    while gate.in_flight and time.monotonic() < deadline:
+        time.sleep(0.05)
+    check(policy.stats()["hedged"] > stats["hedged"] and gate.in_flight == 0,
+          "a duplicate takes a free gate slot and gives it back")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+Behaviour check for parse_server.py against the local stub API (no network, no API spend).
+
+Starts stub_openai_server in a thread and three ParseService instances in-process, then
+checks singleflight coalescing, the upstream gate, 504 on a passed deadline, 503 on a
+full queue and the /health counters. Exits non-zero when a check fails:
+
+    python check_service.py
+"""
+import asyncio
+import json
+import os
+import sys
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import property_parser
+from parse_server import serve
+from stub_openai_server import start_stub_server
+
+STUB_LATENCY = 0.5
+MAX_UPSTREAM = 2
+
+def http(url, payload=None):
+    """(status, JSON body) for a GET, or a POST when payload is given."""
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+async def start_service(**kwargs):
+    """Runs serve() on a free port and returns (base url, service)."""
+    ready = asyncio.get_running_loop().create_future()
+    asyncio.ensure_future(serve(port=0, ready=lambda server, service: ready.set_result((server, service)), **kwargs))
+    server, service = await ready
+    return f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}", service
+
+async def concurrently(url, payloads):
+    """Sends every payload at once (one client thread each) and returns the replies in order."""
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=len(payloads)) as pool:
+        return await asyncio.gather(*(loop.run_in_executor(pool, http, url, payload) for payload in payloads))
+
+async def run_checks(stub):
+    failures = []
+
+    def check(ok, message):
+        print(f"{'ok  ' if ok else 'FAIL'} {message}")
+        if not ok:
+            failures.append(message)
+
+    base, _ = await start_service(max_upstream=MAX_UPSTREAM, workers=8)
+
+    before = stub.state.stats()["completions"]
+    replies = await concurrently(base + "/parse", [{"query": "Properties near good coffee"}] * 5)
+    completions = stub.state.stats()["completions"] - before
+    check(all(status == 200 for status, _ in replies), "5 identical requests all answered 200")
+    check(completions == 1, f"5 identical requests made one upstream call (made {completions})")
+    check(sum(body["coalesced"] for _, body in replies) == 4, "4 of the 5 were coalesced onto the first")
+
+    replies = await concurrently(base + "/parse", [{"query": f"Properties with view number {i}"} for i in range(6)])
+    peak = stub.state.stats()["max_in_flight"]
+    check(all(status == 200 for status, _ in replies), "6 different requests all answered 200")
+    check(peak == MAX_UPSTREAM, f"upstream gate held concurrent calls to {MAX_UPSTREAM} (peak {peak})")
+
+    base_slow, slow = await start_service(max_upstream=MAX_UPSTREAM, workers=8)
+    slow.executor.timeout = STUB_LATENCY / 2
+    status, body = (await concurrently(base_slow + "/parse", [{"query": "Properties past their deadline"}]))[0]
+    check(status == 504, f"a parse past its deadline answers 504 (got {status}: {body.get('error')})")
+
+    base_full, full = await start_service(max_upstream=MAX_UPSTREAM, workers=1)
+    capacity = full.executor.workers + full.executor.max_queue
+    replies = await concurrently(base_full + "/parse", [{"query": f"Queued request {i}"} for i in range(capacity + 3)])
+    statuses = [status for status, _ in replies]
+    check(statuses.count(503) >= 1, f"a full queue answers 503 ({statuses.count(503)} of {len(statuses)})")
+    check(statuses.count(200) + statuses.count(503) == len(statuses), "every other request still answered 200")
+
+    status, health = (await concurrently(base + "/health", [None]))[0]
+    check(status == 200 and health["status"] == "ok", "/health answers 200")
+    check(health["coalesced"] == 4, f"/health counts coalesced requests ({health['coalesced']})")
+    check(health["upstream_max_in_flight"] == MAX_UPSTREAM and health["upstream_in_flight"] == 0,
+          "/health reports the upstream gate, now idle")
+    check(health["executor"]["completed"] == 7, f"/health counts completed parses ({health['executor']['completed']})")
+    status, health = (await concurrently(base_slow + "/health", [None]))[0]
+    check(health["executor"]["timed_out"] == 1, f"/health counts timed-out parses ({health['executor']['timed_out']})")
+    return failures
+
+def main():
+    stub = start_stub_server(latency=STUB_LATENCY)
+    os.environ["OPENAI_BASE_URL"] = stub.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    # Every query must reach the stub: no fast path, no cached answers.
+    property_parser.FAST_PATH_ENABLED = False
+    property_parser.PARSE_CACHE_ENABLED = False
+    property_parser.CATALOG_HOT_RELOAD = False
+    failures = asyncio.run(run_checks(stub))
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
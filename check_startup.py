@@ -0,0 +1,60 @@
+"""
+Startup regression check for the headless parsing core.
+
+Imports property_parser in a fresh interpreter, makes sure no GUI, audio or heavy
+third-party modules were pulled in, and checks import and first-parse times against
+a budget. Exits non-zero when a check fails:
+
+    python check_startup.py
+"""
+import json
+import subprocess
+import sys
+
+IMPORT_BUDGET_MS = 100
+FIRST_PARSE_BUDGET_MS = 500  # snapshot load + index build + one fast-path parse
+FORBIDDEN_MODULES = ["tkinter", "PIL", "pandas", "numpy", "openai", "speech_recognition"]
+
+PROBE = r"""
+import json, sys, time
+start = time.perf_counter()
+import property_parser
+imported = time.perf_counter()
+loaded_on_import = [m for m in %r if m in sys.modules]
+property_parser.get_data_list()  # warm the snapshot so the timing below is the steady state
+print(json.dumps({"import_ms": (imported - start) * 1000, "loaded_on_import": loaded_on_import}))
+""" % (FORBIDDEN_MODULES,)
+
+FIRST_PARSE = r"""
+import json, time
+start = time.perf_counter()
+import property_parser
+result = property_parser.get_fast_path_parser(property_parser.get_data_list()).parse(
+    "Properties in Austin with at least 100 units but no more than 200")
+print(json.dumps({"first_parse_ms": (time.perf_counter() - start) * 1000, "parsed": bool(result)}))
+"""
+
+def run(code):
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def main():
+    failures = []
+    probe = run(PROBE)
+    first = run(FIRST_PARSE)
+    print(f"import property_parser: {probe['import_ms']:.1f}ms (budget {IMPORT_BUDGET_MS}ms)")
+    print(f"import + catalog + first fast-path parse: {first['first_parse_ms']:.1f}ms (budget {FIRST_PARSE_BUDGET_MS}ms)")
+    if probe["loaded_on_import"]:
+        failures.append(f"modules loaded on import: {', '.join(probe['loaded_on_import'])}")
+    if probe["import_ms"] > IMPORT_BUDGET_MS:
+        failures.append("import time over budget")
+    if first["first_parse_ms"] > FIRST_PARSE_BUDGET_MS:
+        failures.append("first parse over budget")
+    if not first["parsed"]:
+        failures.append("fast path did not parse the probe request")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Ordering check for voice_engine.py, run offline on a generated recording.
+
+Writes a WAV file with four tone bursts ("phrases") of different loudness separated by
+silence, and runs it through VoiceEngine.transcribe_file() with a stub backend. The
+backend names each phrase by its peak level and answers the earliest phrases slowest, so
+the recognitions finish in reverse order. Checks that the transcript (and every partial
+transcript reported to on_text) still comes out in capture order, and that a backend
+service error is reported through on_error. Exits non-zero when a check fails:
+
+    python check_voice.py
+"""
+import math
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+import wave
+from array import array
+
+from voice_engine import VOICE_SERVICE_ERROR, VoiceEngine
+
+SAMPLE_RATE = 16000
+WORDS = ["one", "two", "three", "four"]
+PHRASE_SECONDS = 0.5
+PHRASE_LEVEL = 4000    # phrase i peaks at (i + 1) * PHRASE_LEVEL
+GAP_SECONDS = 1.5      # longer than the recognizer's pause_threshold, so each burst is its own phrase
+ENERGY_THRESHOLD = 1000
+
+def write_recording(path):
+    frames = bytearray()
+
+    def samples(seconds, amplitude):
+        for n in range(int(seconds * SAMPLE_RATE)):
+            frames.extend(struct.pack("<h", int(amplitude * math.sin(2 * math.pi * 440 * n / SAMPLE_RATE))))
+
+    samples(GAP_SECONDS, 0)
+    for i in range(len(WORDS)):
+        samples(PHRASE_SECONDS, (i + 1) * PHRASE_LEVEL)
+        samples(GAP_SECONDS, 0)
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(bytes(frames))
+
+def phrase_index(audio):
+    """Which burst an AudioData holds, from its peak level, or None for silence."""
+    peak = max((abs(sample) for sample in array("h", audio.frame_data)), default=0)
+    if peak < PHRASE_LEVEL / 2:
+        return None
+    return min(range(len(WORDS)), key=lambda i: abs(peak - (i + 1) * PHRASE_LEVEL))
+
+def make_engine(backend, workers, tmp):
+    """A VoiceEngine with a fixed energy threshold, so the phrase boundaries do not depend on adaptation."""
+    engine = VoiceEngine(backend=backend, workers=workers, calibration_path=os.path.join(tmp, "calibration.json"))
+    recognizer = engine.setup()
+    recognizer.dynamic_energy_threshold = False
+    recognizer.energy_threshold = ENERGY_THRESHOLD
+    return engine
+
+def main():
+    failures = []
+
+    def check(ok, message):
+        print(f"{'ok  ' if ok else 'FAIL'} {message}")
+        if not ok:
+            failures.append(message)
+
+    finished = []
+    lock = threading.Lock()
+
+    def slow_first_backend(recognizer, audio):
+        import speech_recognition as sr
+        index = phrase_index(audio)
+        if index is None:
+            raise sr.UnknownValueError()  # what a real backend does with trailing silence
+        time.sleep(0.2 * (len(WORDS) - index))  # the first phrase is recognized last
+        with lock:
+            finished.append(index)
+        return WORDS[index]
+
+    def failing_backend(recognizer, audio):
+        import speech_recognition as sr
+        raise sr.RequestError("stub: service unavailable")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "phrases.wav")
+        write_recording(path)
+
+        partials = []
+        engine = make_engine(slow_first_backend, len(WORDS), tmp)
+        text = engine.transcribe_file(path, on_text=partials.append)
+        expected = " ".join(WORDS)
+        check(text == expected, f"transcript is in capture order ({text!r})")
+        check(sorted(finished) == list(range(len(WORDS))) and finished != sorted(finished),
+              f"recognitions ran in parallel and finished out of order {finished}")
+        prefixes = [" ".join(WORDS[:n]) for n in range(1, len(WORDS) + 1)]
+        check(all(partial in prefixes for partial in partials) and partials == sorted(partials, key=len),
+              f"on_text only ever saw ordered prefixes {partials}")
+
+        errors = []
+        engine = make_engine(failing_backend, 1, tmp)
+        text = engine.transcribe_file(path, on_error=errors.append)
+        check(errors == [VOICE_SERVICE_ERROR] and text == "", "a backend service error is reported once through on_error")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+Local US city gazetteer.
+
+Place names from us_places.txt are compiled into a token trie, and Gazetteer.extract()
+reads the city list out of a request in one left-to-right pass: a list starts after "in"
+(or at the very start of the request) and continues across ",", "and", "or" and "&", so
+"in Dallas, Fort Worth, and Coppell" gives ["Dallas", "Fort Worth", "Coppell"]. Longest
+match wins ("Kansas City" over "Kansas"), matching ignores case and punctuation, and a
+trailing state ("Austin, TX", "Portland Oregon") is consumed with the city. Place names
+are also ordinary words ("Mobile", "Surprise", "Allen"), so a list at the very start of
+a request is only taken when it is capitalized and followed by a word like "properties".
+A known name that is only the start of a longer place ("Mission" in "Mission Viejo",
+"Dallas" in "Dallas-Fort Worth") is not trusted either: when the next word is joined by a
+hyphen, or is capitalized and not a list separator, a state or a word in CITY_FOLLOWERS,
+the list is marked incomplete.
+
+us_places.txt is a hand-picked list of about 630 larger US cities and suburbs, not a full
+gazetteer. A place missing from it is not lost: the request is marked incomplete and the
+model extracts the cities instead.
+"""
+import os
+import re
+import threading
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "us_places.txt")
+LIST_SEPARATORS = {",", "and", "or", "&"}
+# Words that may follow a place name at the very start of a request ("Austin properties with ...").
+PLACE_CONTEXT = {
+    "apartment", "apartments", "area", "building", "buildings", "deals", "listings", "market", "metro",
+    "multifamily", "near", "properties", "property", "submarket", "that", "where", "with"
+}
+# Words that may follow a city even when capitalized ("in Austin With a pool"); any other
+# capitalized word there probably continues a place name the list does not have.
+CITY_FOLLOWERS = PLACE_CONTEXT | {
+    "above", "at", "below", "between", "built", "by", "for", "from", "in", "of", "on", "over", "under", "within",
+    "without"
+}
+TOKEN_SYNONYMS = {"st": "saint", "ste": "sainte", "ft": "fort", "mt": "mount"}
+_END = ""  # trie key marking the end of a place name
+
+def place_tokens(text):
+    """Lowercased word tokens with their (start, end) offsets; "St." and "Saint" both give "saint"."""
+    tokens = []
+    for match in re.finditer(r"[A-Za-z0-9]+(?:'[A-Za-z]+)?|[,&]", text):
+        word = match.group().lower()
+        tokens.append((TOKEN_SYNONYMS.get(word, word), match.start(), match.end(), match.group()))
+    return tokens
+
+class Gazetteer:
+    """Token trie over place names; see the module docstring for how extract() reads city lists."""
+    def __init__(self, places):
+        # places: iterable of (name, state code, state name)
+        self.trie = {}
+        self.states = {}
+        self.state_names = {}
+        for name, code, state in places:
+            node = self.trie
+            for word, *_ in place_tokens(name):
+                node = node.setdefault(word, {})
+            node.setdefault(_END, name)
+            self.states.setdefault(name, set()).add(code)
+            self.state_names[code.lower()] = code
+            self.state_names[tuple(w for w, *_ in place_tokens(state))] = code
+
+    def __len__(self):
+        return len(self.states)
+
+    def longest_match(self, tokens, start):
+        """(name, end) for the longest place name starting at tokens[start], or None."""
+        node, found = self.trie, None
+        for i in range(start, len(tokens)):
+            node = node.get(tokens[i][0])
+            if node is None:
+                break
+            if _END in node:
+                found = (node[_END], i + 1)
+        return found
+
+    def state_suffix(self, tokens, start, name):
+        """Index just past a state ("TX", ", Texas") naming one of the place's states, else start."""
+        comma = start < len(tokens) and tokens[start][0] == ","
+        i = start + 1 if comma else start
+        # Lowercase codes only count after a comma, so "in" and "or" stay words rather than Indiana and Oregon.
+        code_ok = i < len(tokens) and (tokens[i][3].isupper() or comma and tokens[i][0] not in LIST_SEPARATORS)
+        if code_ok and self.state_names.get(tokens[i][0]) in self.states[name]:
+            return i + 1
+        for length in (3, 2, 1):
+            words = tuple(t[0] for t in tokens[i:i + length])
+            if len(words) == length and self.state_names.get(words) in self.states[name]:
+                return i + length
+        return start
+
+    def is_state(self, tokens, i):
+        """Whether tokens[i] starts a state code or name."""
+        return any(tuple(t[0] for t in tokens[i:i + length]) in self.state_names for length in (3, 2)) \
+            or (tokens[i][3].isupper() or len(tokens[i][0]) > 2) and tokens[i][0] in self.state_names
+
+    def continues_place(self, text, tokens, i, ignore):
+        """
+        Whether tokens[i], right after a matched place, looks like more of the same name:
+        joined to it by a hyphen ("Dallas-Fort Worth"), or a capitalized word that is not a
+        separator, a state, a word in CITY_FOLLOWERS or in `ignore` ("Mission Viejo").
+        """
+        word = tokens[i][0]
+        if word in LIST_SEPARATORS:
+            return False
+        if text[tokens[i - 1][2]:tokens[i][1]] == "-":
+            return True
+        return tokens[i][3][0].isupper() and word not in CITY_FOLLOWERS and word not in ignore \
+            and not self.is_state(tokens, i)
+
+    def read_list(self, text, tokens, i, ignore, strict):
+        """
+        Reads a city list starting at tokens[i]. Returns (names, spans, end, capitalized,
+        unknown): end is the token index just past the list, capitalized whether every place
+        in it starts with a capital, and unknown whether a capitalized word that is not a
+        known place stands where a city should be (right after "in" when strict, or after a
+        list separator), or a matched place looks cut short (see continues_place()).
+        Lowercase words in `ignore` never count as unknown places.
+        """
+        names, spans, capitalized, unknown = [], [], True, False
+        while i < len(tokens):
+            match = self.longest_match(tokens, i)
+            if match is None:
+                if (strict or names) and tokens[i][3][0].isupper() and tokens[i][0] not in ignore:
+                    unknown = True
+                break
+            name, end = match
+            end = self.state_suffix(tokens, end, name)
+            if end < len(tokens) and self.continues_place(text, tokens, end, ignore):
+                unknown = True
+                break
+            names.append(name)
+            spans.append((tokens[i][1], tokens[end - 1][2]))
+            capitalized = capitalized and tokens[i][3][0].isupper()
+            i = end
+            if i >= len(tokens) or tokens[i][0] not in LIST_SEPARATORS:
+                break
+            while i < len(tokens) and tokens[i][0] in LIST_SEPARATORS:
+                i += 1
+        return names, spans, i, capitalized, unknown
+
+    def extract(self, text, ignore=()):
+        """
+        Returns (cities, spans, complete). spans are the (start, end) character offsets of
+        each city, including any state suffix. complete is False when the caller should not
+        trust the list: a city list holds a capitalized word that is not a known place
+        (e.g. "in Dallas and Smallville"), a known place is only the start of a longer name
+        ("in Mission Viejo", "in Dallas-Fort Worth"), or the request starts with a place name that
+        does not read as a place ("Mobile home parks", "Surprise me", "Orange County").
+        The caller can then fall back to something that reads places itself.
+        """
+        tokens = place_tokens(text)
+        cities, spans, complete = [], [], True
+
+        def add(names, found):
+            cities.extend(name for name in names if name not in cities)
+            spans.extend(found)
+
+        # A list at the very start only counts when it is capitalized and followed by a word
+        # such as "properties" (or nothing at all): "Austin apartments", "Dallas and Fort Worth".
+        names, found, i, capitalized, unknown = self.read_list(text, tokens, 0, ignore, strict=False)
+        if unknown:
+            complete = False
+        elif names:
+            if capitalized and (i == len(tokens) or tokens[i][0] in PLACE_CONTEXT):
+                add(names, found)
+            else:
+                complete = False
+        while i < len(tokens):
+            if tokens[i][0] != "in":
+                i += 1
+                continue
+            names, found, i, _, unknown = self.read_list(text, tokens, i + 1, ignore, strict=True)
+            add(names, found)
+            complete = complete and not unknown
+        return cities, spans, complete
+
+def load_gazetteer(path=GAZETTEER_PATH):
+    """Reads a STATE|State Name|Place,Place,... file (lines starting with # are comments)."""
+    places = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            code, state, names = line.split("|", 2)
+            places.extend((name.strip(), code, state) for name in names.split(",") if name.strip())
+    return Gazetteer(places)
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+def get_gazetteer():
+    """The shared Gazetteer for us_places.txt, loaded on first use."""
+    global _gazetteer
+    if _gazetteer is None:
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                _gazetteer = load_gazetteer()
+    return _gazetteer
@@ -0,0 +1,207 @@
+"""
+Hedged upstream calls, to cut the tail latency caused by the occasional slow completion.
+
+    policy = get_hedge_policy()
+    result = policy.run(lambda: client.chat.completions.create(...), kind="complete")
+
+run() starts the call and waits up to the HEDGE_PERCENTILE latency of recent calls of the
+same kind. Each kind keeps its own window, because a streamed call is timed to its first
+chunk and a non-streamed one to its full answer. If nothing has come back by then, it
+starts one duplicate and returns whichever finishes first. The other one is aborted: a
+long-running attempt calls check_aborted() as it goes and stops with AttemptAborted, and
+a result that still arrives is handed to `discard` (property_parser closes a losing
+stream there, which drops its connection). Duplicates are paid for from a budget: every
+call earns HEDGE_BUDGET of a hedge, so at most that fraction of calls is ever sent twice.
+With a `gate`, a duplicate also needs a free slot there and is skipped when there is none.
+Nothing is hedged until HEDGE_MIN_SAMPLES latencies of that kind have been seen.
+
+stats() reports the hedge rate (duplicates sent per call), the win rate (how often the
+duplicate finished first) and how often the budget or the gate held a hedge back.
+"""
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+from query_executor import check_cancelled
+
+HEDGE_PERCENTILE = 0.95   # hedge a call still running at this percentile of recent latencies
+HEDGE_WINDOW = 200        # recent latencies the percentile is taken over
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.05    # seconds; never hedge sooner than this
+HEDGE_BUDGET = 0.05       # duplicates allowed per call
+HEDGE_BURST = 5           # unused budget that can be saved up for a slow spell
+POLL_SECONDS = 0.1        # how often a waiting caller checks for cancellation
+
+current_abort = contextvars.ContextVar("hedge_abort", default=None)
+
+class AttemptAborted(Exception):
+    """Raised inside an attempt that lost to the other one."""
+
+def check_aborted():
+    """Raises AttemptAborted if this thread is running an attempt that has already lost."""
+    aborted = current_abort.get()
+    if aborted is not None and aborted.is_set():
+        raise AttemptAborted()
+
+def start_attempt(fn):
+    """
+    Runs fn() on its own thread (with the caller's context, so deadlines and request ids
+    carry over). future.abort() tells the attempt to stop at its next check_aborted().
+    """
+    future = Future()
+    aborted = threading.Event()
+    future.abort = aborted.set
+    context = contextvars.copy_context()
+    context.run(current_abort.set, aborted)
+    started = time.monotonic()
+
+    def target():
+        try:
+            future.set_result((context.run(fn), time.monotonic() - started))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=target, name="hedge-attempt", daemon=True).start()
+    return future
+
+class HedgePolicy:
+    def __init__(self, percentile=HEDGE_PERCENTILE, window=HEDGE_WINDOW, min_samples=HEDGE_MIN_SAMPLES,
+                 min_delay=HEDGE_MIN_DELAY, budget=HEDGE_BUDGET, burst=HEDGE_BURST):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.budget = budget
+        self.burst = burst
+        self.window = window
+        self.latencies = {}  # kind -> recent latencies
+        self.credit = 0.0
+        self.lock = threading.Lock()
+        self.counts = {"calls": 0, "hedged": 0, "hedge_wins": 0, "budget_denied": 0, "gate_denied": 0, "errors": 0}
+
+    def record(self, kind, seconds):
+        with self.lock:
+            self.latencies.setdefault(kind, deque(maxlen=self.window)).append(seconds)
+
+    def delay(self, kind):
+        """Seconds to wait before hedging a call of this kind, or None while there are too few samples."""
+        with self.lock:
+            latencies = self.latencies.get(kind, ())
+            if len(latencies) < self.min_samples:
+                return None
+            ordered = sorted(latencies)
+        index = min(len(ordered) - 1, int(self.percentile * len(ordered)))
+        return max(self.min_delay, ordered[index])
+
+    def earn(self):
+        with self.lock:
+            self.counts["calls"] += 1
+            self.credit = min(self.burst, self.credit + self.budget)
+
+    def spend(self):
+        with self.lock:
+            if self.credit < 1:
+                self.counts["budget_denied"] += 1
+                return False
+            self.credit -= 1
+            self.counts["hedged"] += 1
+            return True
+
+    def run(self, fn, discard=None, kind="complete", gate=None):
+        """
+        Calls fn(), hedging it if it is slow. Returns the first successful result. An
+        attempt that fails is only reported if the other one fails too (or was never
+        started). The losing attempt is aborted, and its result is passed to discard if
+        it arrives anyway. A duplicate takes a slot in gate (an UpstreamGate) without
+        waiting for one, and holds it until both attempts are done.
+        """
+        self.earn()
+        delay = self.delay(kind)
+        attempts = [start_attempt(fn)]
+        deadline = None if delay is None else time.monotonic() + delay
+        winner = None
+        try:
+            while winner is None:
+                timeout = POLL_SECONDS
+                if deadline is not None:
+                    timeout = max(0.0, min(timeout, deadline - time.monotonic()))
+                done, _ = wait(attempts, timeout=timeout, return_when=FIRST_COMPLETED)
+                check_cancelled()
+                for future in done:
+                    if future.exception() is None:
+                        winner = future
+                        break
+                pending = [future for future in attempts if not future.done()]
+                if winner is None and not pending:
+                    with self.lock:
+                        self.counts["errors"] += 1
+                    attempts[-1].result()  # raises the last attempt's error
+                if winner is None and deadline is not None and time.monotonic() >= deadline:
+                    deadline = None
+                    if self.admit(gate):
+                        attempts.append(start_attempt(fn))
+                        if gate is not None:
+                            threading.Thread(target=self.release, args=(attempts, gate), daemon=True).start()
+        finally:
+            for future in attempts:
+                if future is not winner:
+                    future.abort()
+                    future.add_done_callback(lambda f: self.drop(f, discard))
+        result, seconds = winner.result()
+        self.record(kind, seconds)
+        if len(attempts) > 1 and winner is attempts[1]:
+            with self.lock:
+                self.counts["hedge_wins"] += 1
+        return result
+
+    def admit(self, gate):
+        """Whether a duplicate may be sent now: it needs a free gate slot and hedge budget."""
+        if gate is not None and not gate.try_enter():
+            with self.lock:
+                self.counts["gate_denied"] += 1
+            return False
+        if not self.spend():
+            if gate is not None:
+                gate.__exit__(None, None, None)
+            return False
+        return True
+
+    def release(self, attempts, gate):
+        """Gives the duplicate's gate slot back once neither attempt is still talking to the API."""
+        wait(attempts)
+        gate.__exit__(None, None, None)
+
+    def drop(self, future, discard):
+        if discard is None or future.cancelled() or future.exception() is not None:
+            return
+        try:
+            discard(future.result()[0])
+        except Exception:
+            pass
+
+    def stats(self):
+        with self.lock:
+            kinds = sorted(self.latencies)
+        delays = {kind: self.delay(kind) for kind in kinds}
+        with self.lock:
+            calls, hedged = self.counts["calls"], self.counts["hedged"]
+            return dict(
+                self.counts,
+                hedge_rate=(hedged / calls) if calls else 0.0,
+                win_rate=(self.counts["hedge_wins"] / hedged) if hedged else 0.0,
+                hedge_after_ms={kind: round(delay * 1000, 1) if delay is not None else None for kind, delay in delays.items()},
+                samples={kind: len(self.latencies[kind]) for kind in kinds}
+            )
+
+_hedge_policy = None
+_hedge_policy_lock = threading.Lock()
+
+def get_hedge_policy():
+    """The process-wide HedgePolicy with the default settings."""
+    global _hedge_policy
+    if _hedge_policy is None:
+        with _hedge_policy_lock:
+            if _hedge_policy is None:
+                _hedge_policy = HedgePolicy()
+    return _hedge_policy
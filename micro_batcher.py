@@ -0,0 +1,136 @@
+"""
+Micro-batching: requests that arrive close together share one upstream call.
+
+    batcher = MicroBatcher(run_batch, window=0.03, max_size=8)
+    result = batcher.call(item)   # blocks until the batch holding item has run
+
+A batch is sent once it holds max_size items or its oldest item has waited `window`
+seconds, whichever comes first. run_batch(items) gets the items in arrival order and
+returns one result per item. None means "not answered", and the caller then handles
+that item on its own; property_parser retries it as a single request. Several batches
+can be in flight at once (`workers`).
+
+Each item keeps its caller's context. An item whose query was cancelled or timed out
+before its batch is sent is dropped from the batch. The batch itself runs under a
+BatchToken with the tightest deadline among its items, and with the tuple of their
+request ids bound, so its spans are traced against every request in it.
+"""
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from query_executor import QueryToken, check_cancelled, current_token
+from tracing import current_request_id
+
+BATCH_WORKERS = 16            # batches in flight at once
+POLL_SECONDS = 0.1            # how often a waiting caller checks for cancellation
+
+class BatchToken(QueryToken):
+    """The tightest deadline of the items' tokens; cancelled once every item's query is."""
+    def __init__(self, tokens):
+        super().__init__(None)
+        self.tokens = tokens
+        deadlines = [token.deadline for token in tokens if token is not None and token.deadline is not None]
+        self.deadline = min(deadlines) if deadlines else None
+
+    def check(self):
+        if all(token is not None and token.cancelled for token in self.tokens):
+            self.cancel()
+        super().check()
+
+class MicroBatcher:
+    def __init__(self, run_batch, window, max_size, workers=BATCH_WORKERS):
+        self.run_batch = run_batch
+        self.window = window
+        self.max_size = max_size
+        self.workers = workers
+        self.condition = threading.Condition()
+        self.pending = []    # (item, future, arrived, caller's context)
+        self.pool = None
+        self.thread = None
+        self.counts = {"requests": 0, "batches": 0, "batched_requests": 0, "max_batch_size": 0,
+                       "unanswered": 0, "failed_batches": 0, "dropped": 0}
+
+    def submit(self, item):
+        """Queues item for the next batch and returns a Future for its result."""
+        future = Future()
+        with self.condition:
+            if self.thread is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="batch")
+                self.thread = threading.Thread(target=self.flush_loop, name="micro-batcher", daemon=True)
+                self.thread.start()
+            self.pending.append((item, future, time.monotonic(), contextvars.copy_context()))
+            self.counts["requests"] += 1
+            self.condition.notify()
+        return future
+
+    def call(self, item):
+        """submit() and wait, checking for cancellation of the calling query while waiting."""
+        future = self.submit(item)
+        while not wait([future], timeout=POLL_SECONDS).done:
+            check_cancelled()
+        return future.result()
+
+    def flush_loop(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                deadline = self.pending[0][2] + self.window
+                while len(self.pending) < self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch, self.pending = self.pending[:self.max_size], self.pending[self.max_size:]
+            self.pool.submit(self.run, batch)
+
+    def run(self, batch):
+        live = []
+        for entry in batch:
+            _, future, _, context = entry
+            try:
+                context.run(check_cancelled)
+                live.append(entry)
+            except Exception as e:
+                future.set_exception(e)  # cancelled or past its deadline while queued: not worth sending
+        if len(live) < len(batch):
+            with self.condition:
+                self.counts["dropped"] += len(batch) - len(live)
+        batch = live
+        if not batch:
+            return
+        token = BatchToken([context.get(current_token) for _, _, _, context in batch])
+        request_ids = tuple(context.get(current_request_id) for _, _, _, context in batch)
+        try:
+            results = contextvars.Context().run(self.run_in_context, token, request_ids,
+                                                [item for item, _, _, _ in batch])
+        except Exception as e:
+            print(f"Batch of {len(batch)} failed, answering its requests one by one: {e}")
+            results = None
+        if results is not None and len(results) != len(batch):
+            print(f"Batch of {len(batch)} returned {len(results)} results, answering its requests one by one")
+            results = None
+        with self.condition:
+            self.counts["batches"] += 1
+            self.counts["batched_requests"] += len(batch)
+            self.counts["max_batch_size"] = max(self.counts["max_batch_size"], len(batch))
+            if results is None:
+                self.counts["failed_batches"] += 1
+            results = results or [None] * len(batch)
+            self.counts["unanswered"] += sum(result is None for result in results)
+        for (_, future, _, _), result in zip(batch, results):
+            future.set_result(result)
+
+    def run_in_context(self, token, request_ids, items):
+        current_token.set(token)
+        current_request_id.set(tuple(rid for rid in request_ids if rid is not None) or None)
+        return self.run_batch(items)
+
+    def stats(self):
+        with self.condition:
+            batches = self.counts["batches"]
+            return dict(self.counts, queued=len(self.pending), window_ms=round(self.window * 1000, 1),
+                        max_size=self.max_size,
+                        avg_batch_size=(self.counts["batched_requests"] / batches) if batches else 0.0)
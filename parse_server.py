@@ -0,0 +1,235 @@
+"""
+Local HTTP service exposing process_user_input to other apps.
+
+    python parse_server.py --port 8080 --max-upstream 8
+
+    POST /parse    {"query": "Properties in Austin with at least 100 units"}
+                   -> 200 {"result": {...}, "coalesced": false}
+    POST /search   {"query": "...", "page_size": 50, "after": null}
+                   -> 200 {"result": {...}, "page": {"rows": [...], "next_after": 1234, ...}}
+    GET  /health   -> 200 {"status": "ok", ...request, upstream and cache metrics}
+
+All requests share one OpenAI client (and its connection pool). At most --max-upstream
+OpenAI calls run at once, and identical requests that arrive while the same query is
+already being parsed wait for that call instead of starting another one (singleflight).
+Parses run on a bounded QueryExecutor: each has a deadline (504 when it passes), transient
+OpenAI errors are retried with backoff, and a full queue answers 503 instead of piling up.
+--hedge sends a duplicate of any OpenAI call slower than the recent p95 (within a small
+budget, and only while a --max-upstream slot is free). --batch N parses up to N requests
+that arrive within a few milliseconds of each other in one OpenAI call. /search also runs
+the parse against the local property store (property_store.py) and returns one page of
+matching properties. Set OPENAI_BASE_URL to
+run against stub_openai_server.py instead of the real API.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import property_parser
+from property_parser import UpstreamGate, get_catalog_manager, get_client, get_data_list, get_parse_cache, normalize_request, process_user_input
+from hedging import get_hedge_policy
+from property_store import STORE_PAGE_SIZE, get_property_store
+from query_executor import QueryExecutor, QueryRejected, QueryTimeout
+from tracing import new_request_id, tracer
+
+MAX_BODY_BYTES = 64 * 1024
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error", 503: "Service Unavailable", 504: "Gateway Timeout"}
+
+class ParseService:
+    def __init__(self, max_upstream=8, workers=32):
+        self.gate = UpstreamGate(max_upstream)
+        self.executor = QueryExecutor(workers=workers, max_queue=workers * 4)
+        self.pending = {}  # normalized query -> future shared by every identical caller
+        self.started = time.time()
+        self.requests = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.parsed_by = {}
+
+    async def parse(self, query):
+        """Returns (result, coalesced). Identical in-flight queries share one process_user_input call."""
+        key = normalize_request(query)
+        future = self.pending.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future), True
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())  # followers may be gone
+        self.pending[key] = future
+        try:
+            handle = self.executor.submit(self.run_parse, query, request_id=new_request_id())
+            try:
+                result = await asyncio.wrap_future(handle.future)
+            except asyncio.CancelledError:
+                handle.cancel()
+                future.cancel()
+                raise
+            future.set_result(result)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self.pending[key]
+        if result:
+            self.parsed_by[result.get("parsed_by")] = self.parsed_by.get(result.get("parsed_by"), 0) + 1
+        return result, False
+
+    def run_parse(self, query):
+        return process_user_input(get_data_list(), query, verbose=False, upstream_gate=self.gate)
+
+    def health(self):
+        return {
+            "status": "ok",
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "catalog_rows": len(get_data_list()),
+            "catalog": get_catalog_manager().stats(),
+            "requests": self.requests,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "coalesced": self.coalesced,
+            "coalescing_keys": len(self.pending),
+            "upstream_in_flight": self.gate.in_flight,
+            "upstream_waiting": self.gate.waiting,
+            "upstream_max_in_flight": self.gate.max_in_flight,
+            "executor": self.executor.stats(),
+            "parsed_by": self.parsed_by,
+            "cache": get_parse_cache().stats() if property_parser.PARSE_CACHE_ENABLED else None,
+            "tokens": property_parser.token_usage.stats(),
+            "hedging": get_hedge_policy().stats() if property_parser.HEDGE_ENABLED else None,
+            "batching": property_parser.get_parse_batcher().stats() if property_parser.BATCHING_ENABLED else None,
+            "latency": tracer.stage_stats()
+        }
+
+    async def handle(self, method, path, body):
+        """Returns (status, payload) for one HTTP request."""
+        path = path.split("?", 1)[0].rstrip("/")
+        if path in ("/health", "/metrics"):
+            return (200, self.health()) if method == "GET" else (405, {"error": "use GET"})
+        if path not in ("/parse", "/search"):
+            return 404, {"error": "not found"}
+        if method != "POST":
+            return 405, {"error": "use POST"}
+        try:
+            payload = json.loads(body or b"{}")
+            query = payload.get("query")
+        except (json.JSONDecodeError, AttributeError):
+            return 400, {"error": "body must be a JSON object"}
+        if not isinstance(query, str) or not query.strip():
+            return 400, {"error": "missing 'query'"}
+        page_size = payload.get("page_size", STORE_PAGE_SIZE)
+        after = payload.get("after")
+        if path == "/search":
+            if not isinstance(page_size, int) or not 1 <= page_size <= 1000 or not (after is None or isinstance(after, int)):
+                return 400, {"error": "'page_size' must be 1-1000 and 'after' an integer or null"}
+            if get_property_store() is None:
+                return 503, {"error": "no property store; create one with property_store.py"}
+
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            result, coalesced = await self.parse(query)
+        except QueryRejected as e:
+            self.errors += 1
+            return 503, {"error": str(e)}
+        except QueryTimeout as e:
+            self.errors += 1
+            return 504, {"error": str(e)}
+        except Exception as e:
+            self.errors += 1
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+        finally:
+            self.in_flight -= 1
+        if not result:
+            self.errors += 1
+            return 422, {"error": "could not process request", "coalesced": coalesced}
+        if path == "/search":
+            try:
+                page = await asyncio.get_running_loop().run_in_executor(
+                    None, get_property_store().search, get_data_list(), result, page_size, after
+                )
+            except Exception as e:
+                self.errors += 1
+                return 500, {"error": f"{type(e).__name__}: {e}", "result": result}
+            return 200, {"result": result, "coalesced": coalesced, "page": page}
+        return 200, {"result": result, "coalesced": coalesced}
+
+    async def serve_connection(self, reader, writer):
+        """Minimal HTTP/1.1 with keep-alive; enough for internal JSON clients."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self.respond(writer, 400, {"error": "malformed request line"}, keep_alive=False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                if length > MAX_BODY_BYTES:
+                    await self.respond(writer, 413, {"error": "body too large"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                status, payload = await self.handle(method.upper(), path, body)
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        data = json.dumps(payload).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + data)
+        await writer.drain()
+
+async def serve(host="127.0.0.1", port=8080, max_upstream=8, workers=32, ready=None):
+    service = ParseService(max_upstream, workers)
+    get_data_list()  # load the catalog and shared client before the first request
+    get_client()
+    server = await asyncio.start_server(service.serve_connection, host, port)
+    if ready is not None:
+        ready(server, service)
+    print(f"Parse service listening on http://{host}:{server.sockets[0].getsockname()[1]}")
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve process_user_input over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-upstream", type=int, default=8, help="concurrent OpenAI calls (default: 8)")
+    parser.add_argument("--workers", type=int, default=32, help="threads running parses (default: 32)")
+    parser.add_argument("--hedge", action="store_true", help="hedge slow OpenAI calls with one duplicate request")
+    parser.add_argument("--batch", type=int, default=0, metavar="N",
+                        help="parse up to N concurrent requests in one OpenAI call (0: off)")
+    args = parser.parse_args()
+    property_parser.HEDGE_ENABLED = args.hedge
+    property_parser.BATCHING_ENABLED = args.batch > 1
+    property_parser.BATCH_MAX_SIZE = max(1, args.batch)
+    try:
+        asyncio.run(serve(args.host, args.port, args.max_upstream, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Before/after prompt size for a fixed query set, without calling the API.
+
+Builds the prompt each query would send with the original JSON catalog dump and with
+the compact encoding, with and without top-k retrieval, and prints characters and
+estimated tokens. Token counts use tiktoken when it is installed and can load the
+model's encoding, and property_parser.estimate_tokens otherwise:
+
+    python prompt_tokens.py
+"""
+from property_parser import OPENAI_MODEL, RETRIEVAL_TOP_K, build_prompt, estimate_tokens, get_data_list
+
+QUERIES = [
+    "Properties in Austin with at least 100 units but no more than 200",
+    "Properties in Atlanta with no more than 10000 square feet but at least 8000 square feet",
+    "Properties in Chicago owned by Bob Jones Company",
+    "Properties in Dallas, Fort Worth, and Coppell near Texas Christian University and Southern Methodist University",
+    "Properties in Boston and Cambridge with at least 100 units and no more than 5000 square feet",
+    "Class A properties in Phoenix with low crime and good schools",
+    "Section 8 properties in Memphis that are not on the watchlist",
+    "Properties in Seattle with rent growth above 5% and occupancy of at least 92%",
+]
+
+def token_counter():
+    try:
+        import tiktoken
+        encoding = tiktoken.encoding_for_model(OPENAI_MODEL)
+        return (lambda text: len(encoding.encode(text))), "tiktoken"
+    except Exception:
+        return estimate_tokens, "estimate"
+
+def main():
+    data = get_data_list()
+    count, method = token_counter()
+    variants = [
+        ("json, full catalog", "json", None),
+        ("json, top-k", "json", RETRIEVAL_TOP_K),
+        ("compact, full catalog", "compact", None),
+        ("compact, top-k", "compact", RETRIEVAL_TOP_K),
+    ]
+    totals = {name: [0, 0] for name, _, _ in variants}
+    print(f"{len(data)} catalog rows, token counts via {method}\n")
+    for query in QUERIES:
+        print(query)
+        for name, encoding, top_k in variants:
+            prompt = build_prompt(data, query, top_k=top_k, encoding=encoding)
+            tokens = count(prompt)
+            totals[name][0] += len(prompt)
+            totals[name][1] += tokens
+            print(f"  {name:<22} {len(prompt):>7} chars {tokens:>7} tokens")
+    print("\nAverage per query")
+    baseline = totals["json, full catalog"][1]
+    for name, (chars, tokens) in totals.items():
+        print(f"  {name:<22} {chars // len(QUERIES):>7} chars {tokens // len(QUERIES):>7} tokens  ({tokens / baseline:.0%} of original)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1662 @@
+import os
+import re
+import math
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import itertools
+import threading
+import contextlib
+from difflib import get_close_matches
+from gazetteer import get_gazetteer
+from hedging import check_aborted, get_hedge_policy
+from micro_batcher import MicroBatcher
+from query_executor import check_cancelled, remaining_time
+from tracing import tracer
+
+CATALOG_COLUMNS = ["filter_category", "filter_name", "table_name", "column_name", "column_value", "field_name", "search_type"]
+CATALOG_SNAPSHOT_VERSION = 1
+
+def load_excel_as_dicts(filename, sheet="Sheet1"):
+    import pandas as pd
+    df = pd.read_excel(filename, sheet_name=sheet)
+    required_columns = ["filter_category", "filter_name", "table_name", "column_name", "search_type"]
+    df = df.dropna(subset=required_columns)
+    # column_value and field_name are optional in the workbook
+    df = df.reindex(columns=CATALOG_COLUMNS).astype(object)
+    return df.where(df.notna(), None).to_dict("records")
+
+def catalog_snapshot_path(filename):
+    return os.path.splitext(filename)[0] + ".catalog.pickle"
+
+def file_sha256(filename):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_catalog(filename, sheet="Sheet1"):
+    """
+    Loads the catalog rows from a pickled snapshot stored next to the workbook, reparsing the
+    workbook only when its mtime/size and contents hash no longer match the snapshot.
+    """
+    stat = os.stat(filename)
+    snapshot_path = catalog_snapshot_path(filename)
+    snapshot = None
+    try:
+        with open(snapshot_path, "rb") as f:
+            snapshot = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        pass
+    if snapshot and snapshot.get("version") == CATALOG_SNAPSHOT_VERSION and snapshot.get("sheet") == sheet:
+        if snapshot["mtime"] == stat.st_mtime and snapshot["size"] == stat.st_size:
+            return snapshot["rows"]
+        sha256 = file_sha256(filename)
+        if snapshot["sha256"] == sha256:
+            # Touched but unchanged: keep the rows, refresh the stat key.
+            save_catalog_snapshot(snapshot_path, dict(snapshot, mtime=stat.st_mtime, size=stat.st_size))
+            return snapshot["rows"]
+    else:
+        sha256 = file_sha256(filename)
+
+    rows = load_excel_as_dicts(filename, sheet)
+    save_catalog_snapshot(snapshot_path, {
+        "version": CATALOG_SNAPSHOT_VERSION,
+        "sheet": sheet,
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+        "sha256": sha256,
+        "rows": rows
+    })
+    return rows
+
+def save_catalog_snapshot(snapshot_path, snapshot):
+    """Writes the snapshot atomically; a read-only checkout just skips the snapshot."""
+    tmp_path = snapshot_path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, snapshot_path)
+    except OSError as e:
+        print(f"Could not write catalog snapshot {snapshot_path}: {e}")
+
+RETRIEVAL_TOP_K = 25          # candidate rows sent to the model per request
+RETRIEVAL_FALLBACK_K = 50     # rows sent when the request is not well covered by the catalog
+RETRIEVAL_MIN_SCORE = 1.0     # below this best score the request counts as not well covered
+RETRIEVAL_MAX_UNMATCHED = 0.5 # ...and likewise when more than this share of its words match no row
+RETRIEVAL_PREFIX_LENGTH = 4   # "walkability" matches "walk" on a shared prefix of at least this length
+RETRIEVAL_PREFIX_WEIGHT = 0.5
+RETRIEVAL_FIELDS = ["filter_name", "filter_category", "field_name"]
+RETRIEVAL_STOPWORDS = {
+    "a", "an", "and", "any", "are", "at", "be", "building", "buildings", "but", "by", "find", "for",
+    "from", "has", "have", "in", "is", "least", "less", "me", "more", "most", "no", "not", "of", "on",
+    "or", "over", "properties", "property", "show", "than", "that", "the", "to", "under", "with", "within"
+}
+RETRIEVAL_SYNONYMS = {
+    "square": "sqft", "feet": "sqft", "foot": "sqft", "sq": "sqft", "ft": "sqft",
+    "apartment": "unit", "college": "university", "near": "closest", "nearby": "closest"
+}
+
+def tokenize(text):
+    """Lowercase word tokens with stopwords removed and a light suffix stem."""
+    tokens = []
+    for word in re.findall(r"[a-z0-9]+", str(text).lower()):
+        if word in RETRIEVAL_STOPWORDS:
+            continue
+        word = RETRIEVAL_SYNONYMS.get(word, word)
+        for suffix in ("ing", "ed", "er", "es", "s"):
+            if len(word) > len(suffix) + 2 and word.endswith(suffix):
+                word = word[:-len(suffix)]
+                break
+        tokens.append(word)
+    return tokens
+
+class CatalogIndex:
+    """
+    BM25 index over the catalog rows, built once when the catalog is loaded.
+    Used to send the model only the rows relevant to a request instead of the whole catalog.
+    """
+    def __init__(self, data, fields=RETRIEVAL_FIELDS, k1=1.5, b=0.75):
+        self.data = data
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # token -> {row position: term frequency}
+        self.doc_lengths = []
+        for pos, row in enumerate(data):
+            tokens = tokenize(" ".join(str(row[f]) for f in fields if row.get(f)))
+            self.doc_lengths.append(len(tokens))
+            for token in tokens:
+                counts = self.postings.setdefault(token, {})
+                counts[pos] = counts.get(pos, 0) + 1
+        self.avg_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+        n = len(data)
+        self.idf = {
+            token: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for token, docs in self.postings.items()
+        }
+        self.prefixes = {}  # first RETRIEVAL_PREFIX_LENGTH letters -> catalog tokens
+        for token in self.postings:
+            if len(token) >= RETRIEVAL_PREFIX_LENGTH and not token.isdigit():
+                self.prefixes.setdefault(token[:RETRIEVAL_PREFIX_LENGTH], []).append(token)
+
+    def expand(self, token):
+        """[(catalog token, weight)] for a request token: itself, or else catalog tokens sharing a prefix with it."""
+        if token in self.postings:
+            return [(token, 1.0)]
+        if len(token) < RETRIEVAL_PREFIX_LENGTH:
+            return []
+        return [(other, RETRIEVAL_PREFIX_WEIGHT) for other in self.prefixes.get(token[:RETRIEVAL_PREFIX_LENGTH], ())
+                if other.startswith(token) or token.startswith(other)]
+
+    def score(self, request):
+        """Returns {row position: BM25 score} for every row sharing a token (or a prefix) with the request."""
+        scores = {}
+        for token in set(tokenize(request)):
+            for other, weight in self.expand(token):
+                idf = self.idf[other] * weight
+                for pos, tf in self.postings[other].items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[pos] / self.avg_length)
+                    scores[pos] = scores.get(pos, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def covered(self, request, scores, min_score, max_unmatched):
+        """
+        Whether the catalog covers the request well: its best score reaches min_score and at
+        most max_unmatched of its words (not counting numbers and known cities) match no row.
+        A request with no such words at all ("Properties in Austin") needs no filter rows.
+        """
+        if GAZETTEER_ENABLED:
+            _, spans, _ = get_gazetteer().extract(request)
+            for start, end in reversed(spans):
+                request = request[:start] + " " + request[end:]
+        words = [token for token in set(tokenize(request)) if not token.isdigit()]
+        if not words:
+            return True
+        if not scores or max(scores.values()) < min_score:
+            return False
+        return sum(not self.expand(token) for token in words) / len(words) <= max_unmatched
+
+    def search(self, request, top_k=RETRIEVAL_TOP_K, min_score=RETRIEVAL_MIN_SCORE,
+               fallback_k=RETRIEVAL_FALLBACK_K, max_unmatched=RETRIEVAL_MAX_UNMATCHED):
+        """
+        Returns candidate rows (in catalog order) for the request: always top_k rows, or
+        fallback_k when the request is not well covered (the best score is below min_score
+        or more than max_unmatched of its words match no row). The best-scoring rows come
+        first; the rest are padded with rows from their filter categories, then in catalog
+        order. The full catalog is returned only when it is that small or top_k is falsy.
+        """
+        if not top_k:
+            return self.data
+        scores = self.score(request)
+        if not self.covered(request, scores, min_score, max_unmatched):
+            top_k = max(top_k, fallback_k)
+        if len(self.data) <= top_k:
+            return self.data
+        chosen = sorted(scores, key=lambda pos: scores[pos], reverse=True)[:top_k]
+        if len(chosen) < top_k:
+            picked = set(chosen)
+            categories = {self.data[pos]["filter_category"] for pos in chosen}
+            same_category = (pos for pos in range(len(self.data)) if self.data[pos]["filter_category"] in categories)
+            for pos in itertools.chain(same_category, range(len(self.data))):
+                if len(chosen) >= top_k:
+                    break
+                if pos not in picked:
+                    picked.add(pos)
+                    chosen.append(pos)
+        return [self.data[pos] for pos in sorted(chosen)]
+
+_catalog_index = (None, None)
+
+def get_catalog_index(data):
+    """Returns the CatalogIndex for data, building it only when the catalog object changes."""
+    global _catalog_index
+    if isinstance(data, CatalogSnapshot):
+        return data.catalog_index
+    if _catalog_index[0] is not data:
+        _catalog_index = (data, CatalogIndex(data))
+    return _catalog_index[1]
+
+ROW_ID_LENGTH = 5  # hex digits after the "r"; lengthened only where two rows would collide
+
+def trigrams(text):
+    padded = f"  {text.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class FuzzyIndex:
+    """
+    Trigram index over a list of strings. lookup() shortlists the keys sharing the most
+    trigrams with the query, then lets get_close_matches pick the closest one, so
+    correcting a misspelled filter name does not scan the whole catalog.
+    """
+    def __init__(self, keys, shortlist=25):
+        self.keys = list(keys)
+        self.shortlist = shortlist
+        self.postings = {}
+        for pos, key in enumerate(self.keys):
+            for gram in trigrams(key):
+                self.postings.setdefault(gram, []).append(pos)
+
+    def lookup(self, text, cutoff=0.6):
+        text = str(text).lower()
+        counts = {}
+        for gram in trigrams(text):
+            for pos in self.postings.get(gram, ()):
+                counts[pos] = counts.get(pos, 0) + 1
+        best = sorted(counts, key=counts.get, reverse=True)[:self.shortlist]
+        match = get_close_matches(text, [self.keys[pos] for pos in best], n=1, cutoff=cutoff)
+        return match[0] if match else None
+
+class RowIdIndex:
+    """
+    Short stable ids for catalog rows ("r" + a content hash prefix), so the model can answer
+    with {row_id, value} and the full row is filled in locally from the catalog.
+    """
+    def __init__(self, data):
+        self.rows_by_id = {}
+        self.ids_by_object = {}
+        ids_by_content = {}
+        for row in data:
+            content = "|".join(str(row.get(c) or "") for c in CATALOG_COLUMNS)
+            row_id = ids_by_content.get(content)
+            if row_id is None:
+                digest = hashlib.sha1(content.encode("utf-8")).hexdigest()
+                length = ROW_ID_LENGTH
+                while "r" + digest[:length] in self.rows_by_id:
+                    length += 1
+                row_id = "r" + digest[:length]
+                ids_by_content[content] = row_id
+                self.rows_by_id[row_id] = row
+            self.ids_by_object[id(row)] = row_id
+        self.rows_by_name = {}
+        for row in data:
+            if row.get("filter_name"):
+                self.rows_by_name.setdefault(str(row["filter_name"]).lower(), row)
+        self.name_fuzzy = FuzzyIndex(self.rows_by_name)
+
+    def id_for(self, row):
+        return self.ids_by_object[id(row)]
+
+    def resolve(self, item):
+        """
+        The catalog row a model-returned filter refers to, by row_id or, failing that, filter_name.
+        Row ids are hashes, so an id one character off says nothing about which row was meant:
+        ids only match exactly, and only a filter_name is corrected to its closest row.
+        """
+        row_id = item.get("row_id") or item.get("id")
+        if row_id is not None:
+            row_id = str(row_id).strip().lower()
+            if row_id in self.rows_by_id:
+                return self.rows_by_id[row_id]
+        name = item.get("filter_name")
+        if name:
+            name = str(name).strip().lower()
+            if name in self.rows_by_name:
+                return self.rows_by_name[name]
+            fixed = self.name_fuzzy.lookup(name)
+            if fixed:
+                return self.rows_by_name[fixed]
+        return None
+
+    def hydrate(self, item):
+        """Expands one {row_id, value} object into a full filter, or None if no row matches."""
+        row = self.resolve(item)
+        return make_filter(row, item.get("value")) if row else None
+
+_row_id_index = (None, None)
+
+def get_row_id_index(data):
+    """Returns the RowIdIndex for data, building it only when the catalog object changes."""
+    global _row_id_index
+    if isinstance(data, CatalogSnapshot):
+        return data.row_ids
+    if _row_id_index[0] is not data:
+        _row_id_index = (data, RowIdIndex(data))
+    return _row_id_index[1]
+
+def hydrate_result(data, parsed):
+    """
+    Turns the model's compact answer into the full output: each filter's catalog row is
+    looked up by row_id and copied locally, so every filter is guaranteed to exist in
+    the catalog. Filters that match no row are dropped.
+    """
+    index = get_row_id_index(data)
+    filters = []
+    for item in parsed.get("filters") or []:
+        hydrated = index.hydrate(item) if isinstance(item, dict) else None
+        if hydrated is None:
+            print(f"Dropping filter that matches no catalog row: {item}")
+            continue
+        filters.append(hydrated)
+    return {"city": parsed.get("city") or [], "filters": filters}
+
+FAST_PATH_ENABLED = True
+GAZETTEER_ENABLED = True  # read cities locally from us_places.txt instead of asking the model
+# Everyday phrasings for common filters. Only used when the named row exists in the catalog.
+FAST_PATH_ALIASES = {
+    "units": "Property Size (Units)",
+    "unit": "Property Size (Units)",
+    "apartments": "Property Size (Units)",
+    "square feet": "Property Size (Sqft)",
+    "square foot": "Property Size (Sqft)",
+    "sq ft": "Property Size (Sqft)",
+    "sqft": "Property Size (Sqft)",
+    "acres": "Acres",
+    "acre": "Acres",
+    "occupancy": "Occupancy (current)",
+    "year built": "Year Built",
+    "built": "Year Built",
+    "year renovated": "Year Renovated",
+    "renovated": "Year Renovated",
+    "purchase price": "Purchase Price",
+    "hold period": "Hold Period (Months)",
+    "months of hold": "Hold Period (Months)",
+    "watchlist": "Loan on Watchlist",
+    "on watchlist": "Loan on Watchlist",
+    "on the watchlist": "Loan on Watchlist",
+    "section8": "Section 8",
+    "opportunity zones": "Opportunity Zone",
+}
+FAST_PATH_FILLER = {
+    "a", "all", "an", "and", "any", "apartment", "apartments", "are", "buildings", "building",
+    "but", "find", "for", "get", "has", "have", "having", "i", "in", "is", "list", "located",
+    "me", "multifamily", "please", "properties", "property", "search", "show", "that", "the",
+    "which", "with", "where"
+}
+LOWER_BOUND_OPS = r"at least|no less than|not less than|no fewer than|more than|greater than|over|above|minimum of|a minimum of"
+UPPER_BOUND_OPS = r"at most|no more than|not more than|less than|fewer than|under|below|maximum of|a maximum of|up to"
+NUMBER = r"\$?\d[\d,]*(?:\.\d+)?(?:[km]\b| thousand\b| million\b)?%?"
+CAPITALIZED = r"[A-Z][\w.&'-]*(?:\s+(?:of\s+|the\s+)?[A-Z][\w.&'-]*)*"
+CAPITALIZED_LIST = rf"{CAPITALIZED}(?:\s*,\s*(?:and\s+)?{CAPITALIZED}|\s+and\s+{CAPITALIZED})*"
+# Filter aliases are found with a token trie and blanked out with one of these markers (same
+# length, so offsets do not move); the patterns below then only have to match the markers.
+NUMERIC_MARK = "\x01"
+FLAG_MARK = "\x02"
+ALIAS_TOKEN = re.compile(r"\w+|[^\w\s]")
+BOUND = rf"(?P<op>{LOWER_BOUND_OPS}|{UPPER_BOUND_OPS})"
+NUMERIC_ALIAS = rf"{NUMERIC_MARK}+"
+# Ordered by priority; earlier patterns claim their span first.
+FAST_PATH_PATTERNS = [
+    re.compile(rf"\bbetween (?P<low>{NUMBER}) and (?P<high>{NUMBER}) (?P<name>{NUMERIC_ALIAS})", re.I),
+    re.compile(rf"(?P<name>{NUMERIC_ALIAS})(?: of| is)? between (?P<low>{NUMBER}) and (?P<high>{NUMBER})", re.I),
+    re.compile(rf"\b(?:from )?(?P<low>{NUMBER}) ?(?:-|to) ?(?P<high>{NUMBER}) (?P<name>{NUMERIC_ALIAS})", re.I),
+    re.compile(rf"\b{BOUND} (?P<num>{NUMBER}) (?P<name>{NUMERIC_ALIAS})", re.I),
+    re.compile(rf"(?P<name>{NUMERIC_ALIAS})(?: of| is| that is)? {BOUND} (?P<num>{NUMBER})", re.I),
+    re.compile(rf"\b{BOUND} (?P<num>{NUMBER})(?![\w])", re.I),
+    re.compile(rf"(?:\b(?P<neg>not|non|no|without|excluding)[\s-]+(?:(?:in|on|an|a|the|part of|be)\s+)*)?(?P<flag>{FLAG_MARK}+)", re.I),
+]
+NEAR_PATTERN = re.compile(rf"\bnear\s+(?P<names>{CAPITALIZED_LIST})")
+OWNER_PATTERN = re.compile(rf"\bowned by\s+(?P<owner>{CAPITALIZED})")
+CITY_PATTERN = re.compile(rf"\bin\s+(?P<cities>{CAPITALIZED_LIST})")
+
+def parse_number(text):
+    """'$1.5m' -> 1500000, '10,000' -> 10000, '7.5%' -> 7.5"""
+    text = text.lower().replace("$", "").replace(",", "").replace("%", "").strip()
+    multiplier = 1
+    for suffix, factor in ((" thousand", 1000), (" million", 1000000), ("k", 1000), ("m", 1000000)):
+        if text.endswith(suffix):
+            text, multiplier = text[:-len(suffix)], factor
+            break
+    value = float(text) * multiplier
+    return int(value) if value.is_integer() else value
+
+def split_name_list(text):
+    """'Dallas, Fort Worth, and Coppell' -> ['Dallas', 'Fort Worth', 'Coppell']"""
+    return [part.strip() for part in re.split(r"\s*,\s*(?:and\s+)?|\s+and\s+", text) if part.strip()]
+
+def make_filter(row, value):
+    """Builds one output filter from its catalog row, in the shape parse_request_with_openai returns."""
+    return {
+        "filter_category": row["filter_category"],
+        "filter_name": row["filter_name"],
+        "table_name": row["table_name"],
+        "column_name": row["column_name"],
+        "column_value": row["column_value"],
+        "field_name": row["field_name"],
+        "search_type": "min_max" if row["search_type"] == "min_max" else None,
+        "value": value
+    }
+
+class FastPathParser:
+    """
+    Rule-based parser for the common request shapes (cities, numeric bounds, Yes/No filters,
+    "near X", "owned by X"). parse() returns the same {"city", "filters"} structure as
+    parse_request_with_openai, or None when any part of the request is not understood.
+    """
+    def __init__(self, data):
+        by_name = {row["filter_name"]: row for row in data if row.get("filter_name")}
+        self.rows_by_alias = {str(name).lower(): row for name, row in by_name.items()}
+        # "Walk Score (median)" is also reachable as "walk score" unless another row claims it.
+        short_names = {}
+        for name, row in by_name.items():
+            short = re.sub(r"\s*\(.*?\)", "", str(name).lower()).strip()
+            short_names.setdefault(short, []).append(row)
+        for short, rows in short_names.items():
+            if len(rows) == 1:
+                self.rows_by_alias.setdefault(short, rows[0])
+        for alias, name in FAST_PATH_ALIASES.items():
+            if name in by_name:
+                self.rows_by_alias.setdefault(alias, by_name[name])
+        # First words of filter phrases ("in an Opportunity Zone", "in Section 8") are not unknown cities.
+        self.alias_words = {alias.split()[0] for alias in self.rows_by_alias if alias.split()}
+        self.near_row = by_name.get("Closest University")
+        self.owner_row = by_name.get("Owner")
+        # Token trie over the numeric and Yes/No aliases; "" marks the end of an alias.
+        self.alias_trie = {}
+        for alias, row in self.rows_by_alias.items():
+            if row["search_type"] in ("min_max", "Yes/No"):
+                node = self.alias_trie
+                for token in ALIAS_TOKEN.findall(alias):
+                    node = node.setdefault(token, {})
+                node[""] = row
+
+    def mark_aliases(self, text):
+        """
+        Returns text with every numeric or Yes/No alias overwritten by its marker (longest
+        alias wins), plus {alias start offset: catalog row}.
+        """
+        tokens = [(m.group().lower(), m.start(), m.end()) for m in ALIAS_TOKEN.finditer(text)]
+        marked, rows = list(text), {}
+        i = 0
+        while i < len(tokens):
+            node, found = self.alias_trie, None
+            for j in range(i, len(tokens)):
+                node = node.get(tokens[j][0])
+                if node is None:
+                    break
+                if "" in node:
+                    found = (node[""], j + 1)
+            if found is None:
+                i += 1
+                continue
+            row, end = found
+            start, stop = tokens[i][1], tokens[end - 1][2]
+            marked[start:stop] = (NUMERIC_MARK if row["search_type"] == "min_max" else FLAG_MARK) * (stop - start)
+            rows[start] = row
+            i = end
+        return "".join(marked), rows
+
+    def local_cities(self, text):
+        """
+        The cities in text according to the gazetteer, or None when there are none or the
+        request also names places the gazetteer does not know.
+        """
+        if not GAZETTEER_ENABLED:
+            return None
+        cities, _, complete = get_gazetteer().extract(str(text), ignore=self.alias_words)
+        return cities if cities and complete else None
+
+    def parse(self, request):
+        text = " ".join(re.sub(r"[\x00-\x1f]", " ", str(request)).split())
+        marked, alias_rows = self.mark_aliases(text)
+        claimed = [False] * len(text)
+        matches = []
+
+        def claim(match):
+            if any(claimed[match.start():match.end()]):
+                return False
+            claimed[match.start():match.end()] = [True] * (match.end() - match.start())
+            matches.append(match)
+            return True
+
+        for pattern in FAST_PATH_PATTERNS:
+            for match in pattern.finditer(marked):
+                claim(match)
+        for pattern in (NEAR_PATTERN, OWNER_PATTERN):
+            for match in pattern.finditer(text):
+                claim(match)
+
+        # Cities are read last, from text not already claimed by a filter (e.g. "in an Opportunity Zone").
+        # The gazetteer also reads lowercase names and "Austin, TX". A place it does not know
+        # ("in Smallville", "in Class A buildings") is left to the model.
+        masked = "".join("|" if taken else ch for ch, taken in zip(text, claimed))
+        if GAZETTEER_ENABLED:
+            cities, spans, complete = get_gazetteer().extract(masked, ignore=self.alias_words)
+            if not complete:
+                return None
+            for start, end in spans:
+                claimed[start:end] = [True] * (end - start)
+        else:
+            cities = []
+            for match in CITY_PATTERN.finditer(masked):
+                claim(match)
+                cities.extend(split_name_list(match.group("cities")))
+
+        leftover = "".join(" " if taken else ch for ch, taken in zip(text, claimed))
+        if any(word not in FAST_PATH_FILLER for word in re.findall(r"[a-z0-9$%]+", leftover.lower())):
+            return None
+
+        filters = []
+        by_name = {}
+        last = None
+        for match in sorted(matches, key=lambda m: m.start()):
+            groups = match.groupdict()
+            if match.re is CITY_PATTERN:
+                continue
+            if match.re is NEAR_PATTERN:
+                names = split_name_list(groups["names"])
+                if not self.near_row or not all(re.search(r"universit|college|institute", n, re.I) for n in names):
+                    return None
+                filters.append(make_filter(self.near_row, names))
+                continue
+            if match.re is OWNER_PATTERN:
+                if not self.owner_row:
+                    return None
+                filters.append(make_filter(self.owner_row, [groups["owner"]]))
+                continue
+            if groups.get("flag"):
+                row = alias_rows[match.start("flag")]
+                filters.append(make_filter(row, ["False" if groups.get("neg") else "True"]))
+                continue
+            if groups.get("name"):
+                row = alias_rows[match.start("name")]
+            elif last is not None:
+                row = last  # "at least 100 units but no more than 200"
+            else:
+                return None
+            if row["filter_name"] not in by_name:
+                by_name[row["filter_name"]] = make_filter(row, [None, None])
+                filters.append(by_name[row["filter_name"]])
+            value = by_name[row["filter_name"]]["value"]
+            if groups.get("op"):
+                index = 0 if re.fullmatch(LOWER_BOUND_OPS, groups["op"], re.I) else 1
+                value[index] = parse_number(groups["num"])
+            else:
+                value[0], value[1] = parse_number(groups["low"]), parse_number(groups["high"])
+            last = row
+
+        for item in by_name.values():
+            low, high = item["value"]
+            if low is not None and high is not None and low > high:
+                return None  # "at least 100 units and at most 50 units"; let the model sort it out
+        if not cities and not filters:
+            return None
+        return {"city": cities, "filters": filters}
+
+_fast_path_parser = (None, None)
+
+def get_fast_path_parser(data):
+    """Returns the FastPathParser for data, building it only when the catalog object changes."""
+    global _fast_path_parser
+    if isinstance(data, CatalogSnapshot):
+        return data.fast_path
+    if _fast_path_parser[0] is not data:
+        _fast_path_parser = (data, FastPathParser(data))
+    return _fast_path_parser[1]
+
+PARSE_CACHE_ENABLED = True
+PARSE_CACHE_PATH = "parse_cache.sqlite"
+PARSE_CACHE_MAX_ENTRIES = 5000
+PARSE_CACHE_TTL_SECONDS = 7 * 24 * 3600
+TEMPLATE_CACHE_ENABLED = True  # reuse parses across requests that differ only in numbers, cities and quoted names
+
+def normalize_request(request):
+    """Case, whitespace and punctuation-insensitive form of a request ('10,000' == '10000')."""
+    text = str(request).lower()
+    text = re.sub(r"(?<=\d),(?=\d)", "", text)
+    text = re.sub(r"[^\w\s.$%-]", " ", text)
+    text = re.sub(r"\.(?!\d)", " ", text)
+    return " ".join(text.split())
+
+def catalog_fingerprint(data):
+    """Hash of the catalog rows plus everything else that shapes the prompt."""
+    payload = json.dumps(
+        [data, PROMPT_TEMPLATE, PROMPT_CITY_PARTS, REFINE_PROMPT_TEMPLATE, BATCH_PROMPT_TEMPLATE, CATALOG_ENCODING, OPENAI_MODEL,
+         RETRIEVAL_TOP_K, RETRIEVAL_FALLBACK_K, RETRIEVAL_MIN_SCORE, RETRIEVAL_MAX_UNMATCHED],
+        sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ParseCache:
+    """
+    SQLite-backed cache of parse_request_with_openai results with LRU eviction, a TTL and
+    hit/miss counters. Keys combine the normalized request with the catalog fingerprint,
+    so editing filter_data.xlsx or the prompt invalidates old entries automatically.
+    """
+    def __init__(self, path=PARSE_CACHE_PATH, max_entries=PARSE_CACHE_MAX_ENTRIES, ttl_seconds=PARSE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.template_counts = {"hits": 0, "misses": 0, "rejects": 0}
+        self.lock = threading.Lock()
+        self.fingerprints = (None, None)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS parse_cache ("
+            "key TEXT PRIMARY KEY, result TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS parse_cache_last_used ON parse_cache (last_used)")
+        self.conn.commit()
+
+    def make_key(self, data, request):
+        return self.fingerprint(data) + ":" + normalize_request(request)
+
+    def make_template_key(self, data, template):
+        return self.fingerprint(data) + ":template:" + template
+
+    def fingerprint(self, data):
+        if isinstance(data, CatalogSnapshot):
+            return data.fingerprint
+        if self.fingerprints[0] is not data:
+            self.fingerprints = (data, catalog_fingerprint(data))
+        return self.fingerprints[1]
+
+    def count_template(self, outcome):
+        """outcome: "hits", "misses" or "rejects" (a template was found but its fill-in failed validation)."""
+        with self.lock:
+            self.template_counts[outcome] += 1
+
+    def get(self, key):
+        result = self.lookup(key)
+        with self.lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def lookup(self, key):
+        """The cached result for key, or None; does not touch the hit/miss counters."""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT result, created FROM parse_cache WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] > self.ttl_seconds:
+                self.conn.execute("DELETE FROM parse_cache WHERE key = ?", (key,))
+                self.conn.commit()
+                row = None
+            if not row:
+                return None
+            self.conn.execute("UPDATE parse_cache SET last_used = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            return json.loads(row[0])
+
+    def put(self, key, result):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO parse_cache (key, result, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(result), now, now)
+            )
+            self.conn.execute("DELETE FROM parse_cache WHERE created < ?", (now - self.ttl_seconds,))
+            self.conn.execute(
+                "DELETE FROM parse_cache WHERE key NOT IN "
+                "(SELECT key FROM parse_cache ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+            self.conn.commit()
+
+    def stats(self):
+        with self.lock:
+            size = self.conn.execute("SELECT COUNT(*) FROM parse_cache").fetchone()[0]
+        total = self.hits + self.misses
+        template_total = sum(self.template_counts.values())
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "template_hits": self.template_counts["hits"],
+            "template_misses": self.template_counts["misses"],
+            "template_rejects": self.template_counts["rejects"],
+            "template_hit_rate": (self.template_counts["hits"] / template_total) if template_total else 0.0,
+            "entries": size,
+            "max_entries": self.max_entries
+        }
+
+_parse_cache = None
+
+def get_parse_cache():
+    """The shared ParseCache, opened on first use."""
+    global _parse_cache
+    if _parse_cache is None:
+        _parse_cache = ParseCache()
+    return _parse_cache
+
+# Template cache: "Austin with at least 100 units" and "Denver with at least 250 units" both
+# become "__city__ with at least __n__ units". The first one's parse is stored as a skeleton
+# whose values point at the slots, and the second is answered by filling in its own values.
+TEMPLATE_NUMBER_PATTERN = re.compile(r"(?<![\w.])\d+(?:\.\d+)?(?![\w.])")
+TEMPLATE_QUOTE_PATTERN = re.compile(r'"([^"]+)"|\u201c([^\u201d]+)\u201d')
+
+def request_template(data, request):
+    """
+    Returns (template, slots) for a request, where slots holds its "city", "numbers" and
+    "entities" (quoted names) in order, or None when the request cannot be templated
+    (the gazetteer is off or the request names places it does not know).
+    """
+    if not GAZETTEER_ENABLED:
+        return None
+    text = " ".join(str(request).split())
+    cities, spans, complete = get_gazetteer().extract(text, ignore=get_fast_path_parser(data).alias_words)
+    if not complete:
+        return None
+    holes = [(start, end, "__city__") for start, end in spans]
+    entities = []
+    for match in TEMPLATE_QUOTE_PATTERN.finditer(text):
+        if not any(start < match.end() and match.start() < end for start, end, _ in holes):
+            holes.append((match.start(), match.end(), "__entity__"))
+            entities.append((match.start(), (match.group(1) or match.group(2)).strip()))
+    pieces, last = [], 0
+    for start, end, token in sorted(holes):
+        pieces.append(text[last:start] + " " + token + " ")
+        last = end
+    normalized = normalize_request("".join(pieces) + text[last:])
+    normalized = re.sub(r"__city__(?: (?:and |or )?__city__)+", "__city__", normalized)  # one slot per city list
+    numbers = [float(n) if "." in n else int(n) for n in TEMPLATE_NUMBER_PATTERN.findall(normalized)]
+    template = TEMPLATE_NUMBER_PATTERN.sub("__n__", normalized)
+    return template, {"city": cities, "numbers": numbers, "entities": [name for _, name in sorted(entities)]}
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def valid_filter_value(row, value):
+    """Whether value has the shape the row's search_type expects ([min, max] numbers, or 'True'/'False')."""
+    search_type = row.get("search_type")
+    if search_type == "min_max":
+        if not isinstance(value, list) or not 1 <= len(value) <= 2:
+            return False
+        if not all(v is None or is_number(v) for v in value) or all(v is None for v in value):
+            return False
+        return len(value) < 2 or None in value or value[0] <= value[1]
+    if search_type == "Yes/No":
+        return value in ("True", "False", ["True"], ["False"])
+    values = value if isinstance(value, list) else [value]
+    return not any(is_number(v) for v in values)
+
+def template_skeleton(data, parsed, slots):
+    """
+    The parse with every value that came from the request replaced by a reference to its
+    slot ({"slot": "numbers", "index": 1}), or None when that mapping is not clear-cut: the
+    cities differ from the gazetteer's, a number matches no slot or several, or a value
+    does not fit its row's search_type.
+    """
+    if [c.lower() for c in parsed.get("city") or []] != [c.lower() for c in slots["city"]]:
+        return None
+    row_ids = get_row_id_index(data)
+    filters = []
+    for item in parsed.get("filters") or []:
+        row = row_ids.resolve(item)
+        if row is None or not valid_filter_value(row, item.get("value")):
+            return None
+        values = item["value"] if isinstance(item["value"], list) else [item["value"]]
+        pattern = []
+        for value in values:
+            if is_number(value):
+                matches = [i for i, n in enumerate(slots["numbers"]) if n == value]
+            elif isinstance(value, str):
+                matches = [i for i, name in enumerate(slots["entities"]) if name.lower() == value.lower()]
+            else:
+                matches = None
+            if matches is None or (isinstance(value, str) and not matches):
+                pattern.append(value)  # null bound, or text that is part of the template itself
+            elif len(matches) == 1:
+                pattern.append({"slot": "numbers" if is_number(value) else "entities", "index": matches[0]})
+            else:
+                return None
+        filter_item = {k: v for k, v in item.items() if k != "value"}
+        filters.append({"filter": filter_item, "value": pattern, "listed": isinstance(item["value"], list)})
+    return {"filters": filters}
+
+def fill_template(data, skeleton, slots):
+    """The parse for a new request from a cached skeleton and its slots, or None if any filled value is invalid."""
+    row_ids = get_row_id_index(data)
+    filters = []
+    for entry in skeleton["filters"]:
+        row = row_ids.resolve(entry["filter"])
+        if row is None:
+            return None
+        value = []
+        for part in entry["value"]:
+            if isinstance(part, dict):
+                if part["index"] >= len(slots[part["slot"]]):
+                    return None
+                part = slots[part["slot"]][part["index"]]
+            value.append(part)
+        value = value if entry["listed"] else value[0]
+        if not valid_filter_value(row, value):
+            return None
+        filters.append(dict(entry["filter"], value=value))
+    return {"city": list(slots["city"]), "filters": filters}
+
+CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "filter_data.xlsx")
+
+CATALOG_HOT_RELOAD = True   # watch filter_data.xlsx and swap in a new catalog when it changes
+CATALOG_POLL_SECONDS = 2.0
+
+_client = None
+_catalog_manager = None
+_lazy_lock = threading.Lock()
+
+def get_client():
+    """The shared OpenAI client, created on first use so importing this module stays cheap."""
+    global _client
+    if _client is None:
+        with _lazy_lock:
+            if _client is None:
+                from openai import OpenAI
+                _client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    return _client
+
+def upstream_client():
+    """
+    get_client(), limited to the deadline of the QueryExecutor call running on this thread.
+    OpenAI's own retries are turned off there because the executor retries the whole query.
+    """
+    remaining = remaining_time()
+    if remaining is None:
+        return get_client()
+    check_cancelled()
+    return get_client().with_options(timeout=max(0.1, remaining), max_retries=0)
+
+HEDGE_ENABLED = False  # opt-in: send one duplicate of an OpenAI call that is slower than usual (see hedging.py)
+
+class PeekedStream:
+    """A streamed completion whose first chunk has already arrived, so a hedge can be timed to the first token."""
+    def __init__(self, response):
+        self.response = response
+        try:
+            self.first = next(iter(response), None)
+        except BaseException:
+            response.close()
+            raise
+
+    def __iter__(self):
+        if self.first is not None:
+            yield self.first
+        yield from self.response
+
+    def close(self):
+        self.response.close()
+
+def create_completion(upstream_gate=None, **kwargs):
+    """
+    upstream_client().chat.completions.create(**kwargs), hedged when HEDGE_ENABLED. A
+    stream counts as answered at its first chunk, and a losing stream is closed. A
+    non-streamed call is fetched as a stream when hedged, so the losing attempt can stop
+    between chunks and drop its connection; the caller still gets the whole completion.
+    The duplicate needs a free slot in upstream_gate and is not sent without one.
+    """
+    if not HEDGE_ENABLED:
+        return upstream_client().chat.completions.create(**kwargs)
+    stream = kwargs.get("stream")
+
+    def attempt():
+        if stream:
+            return PeekedStream(upstream_client().chat.completions.create(**kwargs))
+        options = dict(kwargs, stream_options={"include_usage": True})
+        options.pop("stream", None)
+        with upstream_client().chat.completions.stream(**options) as events:
+            for _ in events:
+                check_aborted()  # closing the stream on the way out drops the losing call's connection
+            return events.get_final_completion()
+
+    return get_hedge_policy().run(attempt, discard=lambda response: response.close() if stream else None,
+                                  kind="stream" if stream else "complete", gate=upstream_gate)
+
+def catalog_version(rows):
+    """Short content hash of the catalog rows; the same workbook contents always give the same version."""
+    payload = json.dumps(rows, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:12]
+
+class CatalogSnapshot(list):
+    """
+    One version of the catalog: the rows themselves (it is a list, so it goes wherever
+    `data` is expected) plus every index derived from them, all built up front. A snapshot
+    never changes after it is built, so a query that started on it resolves everything
+    against the same version even if a newer one is swapped in meanwhile.
+    """
+    def __init__(self, rows, version=None):
+        super().__init__(rows)
+        self.version = version or catalog_version(self)
+        self.loaded_at = time.time()
+        self.catalog_index = CatalogIndex(self)
+        self.row_ids = RowIdIndex(self)
+        self.fast_path = FastPathParser(self)
+        self.fingerprint = catalog_fingerprint(self)
+
+class CatalogManager:
+    """
+    Holds the current CatalogSnapshot of a workbook. watch() polls the file's mtime and size
+    in a background thread, builds a complete new snapshot when they change, and then
+    swaps it in with a single assignment. Queries never wait for a rebuild. A workbook
+    that fails to load (e.g. half-saved) keeps the old snapshot and is retried next poll.
+    """
+    def __init__(self, path=CATALOG_PATH, poll_seconds=CATALOG_POLL_SECONDS):
+        self.path = path
+        self.poll_seconds = poll_seconds
+        self.current = None
+        self.stamp = None
+        self.reloads = 0
+        self.last_error = None
+        self.lock = threading.Lock()
+        self.watcher = None
+        self.stopped = threading.Event()
+
+    def file_stamp(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime, stat.st_size
+
+    def get(self):
+        if self.current is None:
+            with self.lock:
+                if self.current is None:
+                    self.stamp = self.file_stamp()
+                    self.current = CatalogSnapshot(load_catalog(self.path))
+        return self.current
+
+    def check(self):
+        """Reloads if the workbook changed since the last load; returns True if a new version was swapped in."""
+        with self.lock:
+            try:
+                stamp = self.file_stamp()
+                if stamp == self.stamp:
+                    return False
+                snapshot = CatalogSnapshot(load_catalog(self.path))
+            except Exception as e:
+                if str(e) != self.last_error:
+                    print(f"Could not reload {self.path}: {e}")
+                self.last_error = str(e)
+                return False
+            self.stamp = stamp
+            self.last_error = None
+            if self.current is not None and snapshot.version == self.current.version:
+                return False  # touched but unchanged
+            previous, self.current = self.current, snapshot
+            self.reloads += 1
+        print(f"Catalog reloaded: version {previous.version if previous else None} -> {snapshot.version} ({len(snapshot)} rows)")
+        return True
+
+    def watch(self):
+        """Starts the polling thread (once)."""
+        with self.lock:
+            if self.watcher is None:
+                self.watcher = threading.Thread(target=self.watch_loop, name="catalog-watcher", daemon=True)
+                self.watcher.start()
+
+    def watch_loop(self):
+        while not self.stopped.wait(self.poll_seconds):
+            self.check()
+
+    def stop(self):
+        self.stopped.set()
+
+    def stats(self):
+        current = self.current
+        return {
+            "version": current.version if current is not None else None,
+            "rows": len(current) if current is not None else 0,
+            "loaded_at": current.loaded_at if current is not None else None,
+            "reloads": self.reloads,
+            "last_error": self.last_error
+        }
+
+def get_catalog_manager():
+    global _catalog_manager
+    if _catalog_manager is None:
+        with _lazy_lock:
+            if _catalog_manager is None:
+                _catalog_manager = CatalogManager()
+    return _catalog_manager
+
+def get_data_list():
+    """
+    The current CatalogSnapshot of filter_data.xlsx, loaded (and indexed) on first use.
+    Call it per query rather than keeping the result: with CATALOG_HOT_RELOAD it returns
+    the newest version after the workbook is edited.
+    """
+    manager = get_catalog_manager()
+    if manager.current is None:
+        manager.get()
+        get_gazetteer()
+    if CATALOG_HOT_RELOAD and manager.watcher is None:
+        manager.watch()
+    return manager.current
+
+class RateLimiter:
+    """Token bucket shared between threads: at most `rate` acquisitions per second, bursts up to `burst`."""
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class UpstreamGate:
+    """Caps concurrent OpenAI calls across threads and reports how many are running and queued."""
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self.semaphore = threading.BoundedSemaphore(max_in_flight)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+
+    def __enter__(self):
+        with self.lock:
+            self.waiting += 1
+        acquired = False
+        try:
+            while not acquired:
+                acquired = self.semaphore.acquire(timeout=0.1)
+                if not acquired:
+                    check_cancelled()  # a cancelled or timed-out query leaves the queue
+        finally:
+            with self.lock:
+                self.waiting -= 1
+                if acquired:
+                    self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self.lock:
+            self.in_flight -= 1
+        self.semaphore.release()
+        return False
+
+    def try_enter(self):
+        """Takes a slot only if one is free right now; returns whether it did. Release it with __exit__."""
+        if not self.semaphore.acquire(blocking=False):
+            return False
+        with self.lock:
+            self.in_flight += 1
+        return True
+
+class StreamingResultParser:
+    """
+    Incremental scanner for the model's JSON output. feed() takes text as it streams in and
+    calls on_city with the "city" list and on_filter with each object in "filters" as soon
+    as that part of the JSON is complete.
+    """
+    def __init__(self, on_filter=None, on_city=None):
+        self.on_filter = on_filter
+        self.on_city = on_city
+        self.text = ""
+        self.pos = 0
+        self.stack = []   # open containers: "{" or "["
+        self.keys = []    # key each open container was assigned to
+        self.starts = []  # offset of each open container in self.text
+        self.in_string = False
+        self.escape = False
+        self.string_start = 0
+        self.last_string = None
+        self.pending_key = None
+
+    def feed(self, chunk):
+        self.text += chunk
+        text = self.text
+        while self.pos < len(text):
+            ch = text[self.pos]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    self.last_string = text[self.string_start + 1:self.pos]
+            elif ch == '"':
+                self.in_string = True
+                self.string_start = self.pos
+            elif ch == ":":
+                self.pending_key = self.last_string
+            elif ch == ",":
+                self.pending_key = None
+            elif ch in "{[":
+                self.keys.append(self.pending_key if self.stack and self.stack[-1] == "{" else None)
+                self.stack.append(ch)
+                self.starts.append(self.pos)
+                self.pending_key = None
+            elif ch in "}]" and self.stack:
+                self.stack.pop()
+                key = self.keys.pop()
+                start = self.starts.pop()
+                self.closed(ch, key, text[start:self.pos + 1])
+            self.pos += 1
+
+    def closed(self, ch, key, fragment):
+        depth = len(self.stack)
+        if ch == "]" and depth == 1 and key == "city" and self.on_city:
+            self.on_city(json.loads(fragment))
+        elif ch == "}" and depth == 2 and self.keys[-1] == "filters" and self.on_filter:
+            self.on_filter(json.loads(fragment))
+
+def process_user_input(data, user_input, rate_limiter=None, verbose=True, upstream_gate=None, on_filter=None, on_city=None):
+    with tracer.span("parse.total"):
+        with tracer.span("parse.fast_path"):
+            parsed_data = get_fast_path_parser(data).parse(user_input) if FAST_PATH_ENABLED else None
+        if parsed_data:
+            parsed_data["parsed_by"] = "fast_path"
+        else:
+            cache = get_parse_cache() if PARSE_CACHE_ENABLED else None
+            with tracer.span("parse.cache_lookup"):
+                cache_key = cache.make_key(data, user_input) if cache else None
+                parsed_data = cache.get(cache_key) if cache else None
+            template = None
+            if not parsed_data and cache and TEMPLATE_CACHE_ENABLED:
+                with tracer.span("parse.template_cache"):
+                    template = request_template(data, user_input)
+                    skeleton = cache.lookup(cache.make_template_key(data, template[0])) if template else None
+                    filled = fill_template(data, skeleton, template[1]) if skeleton else None
+                    if skeleton:
+                        cache.count_template("hits" if filled else "rejects")
+                    elif template:
+                        cache.count_template("misses")
+                if filled:
+                    parsed_data = dict(filled, parsed_by="template_cache")
+            if parsed_data:
+                parsed_data.setdefault("parsed_by", "cache")
+            else:
+                check_cancelled()
+                with tracer.span("parse.gazetteer"):
+                    cities = get_fast_path_parser(data).local_cities(user_input)
+                if BATCHING_ENABLED and not (on_filter or on_city):
+                    # None when the batch did not answer this request; it is then sent on its own.
+                    parsed_data = get_parse_batcher().call((data, user_input, cities, rate_limiter, upstream_gate))
+                if not parsed_data:
+                    parsed_data = parse_request_with_openai(
+                        data, user_input, rate_limiter=rate_limiter, upstream_gate=upstream_gate,
+                        on_filter=on_filter, on_city=on_city, cities=cities
+                    )
+                if parsed_data:
+                    if cache:
+                        cache.put(cache_key, {k: v for k, v in parsed_data.items() if k != "usage"})
+                        skeleton = template_skeleton(data, parsed_data, template[1]) if template else None
+                        if skeleton:
+                            cache.put(cache.make_template_key(data, template[0]), skeleton)
+                    parsed_data["parsed_by"] = "openai"
+    if not parsed_data:
+        if verbose:
+            print("\nError: Could not process user request.")
+        return None
+
+    parsed_data["catalog_version"] = getattr(data, "version", None)
+    if verbose:
+        print(json.dumps(parsed_data, indent=2))
+    return parsed_data
+
+OPENAI_MODEL = "gpt-4o-mini"
+CATALOG_ENCODING = "compact"  # "compact" (header + pipe-separated rows) or "json" (the original indent=2 dump)
+CATALOG_INTROS = {
+    "compact": "Catalog (one row per line, columns separated by '|', an empty cell means null):",
+    "json": "Catalog (a list of dictionaries):"
+}
+# Instructions come first and the user request last. This does not make the prompt
+# cacheable upstream: OpenAI only caches a shared prefix of at least 1024 tokens, the fixed
+# instructions are about 400, and the per-request top-k rows follow them. Only a larger,
+# request-independent catalog block would clear that bar, which is the prompt growth
+# retrieval exists to avoid, so cached_tokens is expected to be 0 here.
+# The city parts change when the cities were already read locally by the gazetteer.
+PROMPT_CITY_PARTS = {
+    "extract": {
+        "city_task": "Extract all city names mentioned in the request.",
+        "city_field": '"city": [ ... ],\n  ',
+        "no_filters": "just return the city with an empty \"filters\" array"
+    },
+    "local": {
+        "city_task": "Ignore city names; they have already been extracted.",
+        "city_field": "",
+        "no_filters": "return an empty \"filters\" array"
+    }
+}
+PROMPT_TEMPLATE = """
+You map a property search request onto rows of the filter catalog listed below.
+
+From the user request at the end, please perform the following tasks:
+1. {city_task}
+2. Extract each filter mentioned in the user query.
+3. "value": the numeric range (e.g., [min, max]) or single value extracted (e.g., [value]).
+4. Search the catalog to find the row that most closely matches each filter and return its row_id.
+
+IMPORTANT:
+- row_id must be copied exactly from the catalog. Do not return any other catalog columns.
+- If the row's search_type is 'min_max', handle numeric min/max. Use null if no lower or upper bound is mentioned.
+- If the row's search_type is "Yes/No", set 'value' to 'True' for yes and 'False' for no
+- If the user references something relevant (like 'University of Texas'), place it in 'value'.
+
+NOTE ABOUT MULTIPLE FILTERS:
+- If the user request contains multiple constraints (e.g., "at least 500 units and 1000 sqft"),
+  return multiple objects in the "filters" array—one object per constraint.
+
+If there are no constraints, {no_filters}.
+
+Return a JSON object with the following structure (valid JSON only):
+
+{{
+  {city_field}"filters": [
+    {{"row_id": "...", "value": [...]}}
+  ]
+}}
+
+{catalog_intro}
+{context_text}
+
+User Request: "{request}"
+""".strip()
+
+def encode_catalog(rows, row_ids, encoding=CATALOG_ENCODING):
+    """
+    Serializes catalog rows (with their row ids) for the prompt. The compact form is a
+    header line plus one pipe-separated line per row, leaving out columns that are empty
+    in every row.
+    """
+    if encoding == "json":
+        return json.dumps([dict(row_id=row_id, **row) for row_id, row in zip(row_ids, rows)], indent=2)
+    columns = [c for c in CATALOG_COLUMNS if any(row.get(c) is not None for row in rows)]
+    lines = ["|".join(["row_id"] + columns)]
+    for row_id, row in zip(row_ids, rows):
+        cells = ("" if row.get(c) is None else str(row[c]).replace("|", "/") for c in columns)
+        lines.append("|".join([row_id, *cells]))
+    return "\n".join(lines)
+
+def build_prompt(data, request, top_k=RETRIEVAL_TOP_K, encoding=CATALOG_ENCODING, local_cities=False):
+    candidates = get_catalog_index(data).search(request, top_k=top_k)
+    row_ids = get_row_id_index(data)
+    return PROMPT_TEMPLATE.format(
+        **PROMPT_CITY_PARTS["local" if local_cities else "extract"],
+        catalog_intro=CATALOG_INTROS[encoding],
+        context_text=encode_catalog(candidates, [row_ids.id_for(row) for row in candidates], encoding),
+        request=request
+    )
+
+def estimate_tokens(text):
+    """Rough BPE token count (words, numbers and punctuation marks) for offline comparisons."""
+    return len(re.findall(r"[A-Za-z]{1,8}|\d{1,3}|[^\w\s]|\n", text))
+
+class TokenUsage:
+    """Running totals of response.usage across OpenAI calls, shared between threads."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+
+    def record(self, usage):
+        """Adds one response.usage and returns it as a plain dict (None if the API sent no usage)."""
+        if usage is None:
+            return None
+        details = getattr(usage, "prompt_tokens_details", None)
+        counts = {
+            "prompt_tokens": usage.prompt_tokens or 0,
+            "completion_tokens": usage.completion_tokens or 0,
+            "cached_tokens": (getattr(details, "cached_tokens", None) or 0) if details else 0
+        }
+        with self.lock:
+            self.requests += 1
+            self.prompt_tokens += counts["prompt_tokens"]
+            self.completion_tokens += counts["completion_tokens"]
+            self.cached_tokens += counts["cached_tokens"]
+        return counts
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "cached_tokens": self.cached_tokens,
+                "avg_prompt_tokens": (self.prompt_tokens / self.requests) if self.requests else 0.0,
+                "avg_completion_tokens": (self.completion_tokens / self.requests) if self.requests else 0.0
+            }
+
+token_usage = TokenUsage()
+
+def parse_request_with_openai(data, request, top_k=RETRIEVAL_TOP_K, rate_limiter=None, upstream_gate=None,
+                              on_filter=None, on_city=None, cities=None):
+    """
+    Asks the model to parse the request. The model answers with catalog row ids, which are
+    hydrated into full catalog rows locally. Passing on_filter/on_city streams the
+    completion and reports the city list and each (hydrated) filter as soon as they are
+    complete; the returned result is the same either way. When `cities` were already
+    read locally, the model is only asked for filters. The call's token counts are added
+    under "usage".
+    """
+    with tracer.span("parse.prompt_build"):
+        prompt = build_prompt(data, request, top_k, local_cities=cities is not None)
+    if cities is not None and on_city:
+        on_city(cities)
+        on_city = None
+    stream = bool(on_filter or on_city)
+    if on_filter:
+        row_ids = get_row_id_index(data)
+        show_filter = on_filter
+
+        def on_filter(item):
+            hydrated = row_ids.hydrate(item)
+            if hydrated:
+                show_filter(hydrated)
+
+    if rate_limiter:
+        with tracer.span("parse.rate_limit_wait"):
+            rate_limiter.acquire()
+    with upstream_gate or contextlib.nullcontext(), tracer.span("parse.llm"):
+        response = create_completion(
+            upstream_gate,
+            model=OPENAI_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.2,
+            response_format={"type": "json_object"},
+            stream=stream,
+            **({"stream_options": {"include_usage": True}} if stream else {})
+        )
+        if stream:
+            partial = StreamingResultParser(on_filter, on_city)
+            usage = None
+            try:
+                for chunk in response:
+                    check_cancelled()
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        partial.feed(chunk.choices[0].delta.content)
+                    if getattr(chunk, "usage", None):
+                        usage = chunk.usage
+            finally:
+                response.close()  # also drops the connection when the query is cancelled mid-stream
+            content = partial.text
+        else:
+            content = response.choices[0].message.content
+            usage = response.usage
+    with tracer.span("parse.json"):
+        parsed = json.loads(content)
+        if cities is not None:
+            parsed["city"] = cities
+        parsed = hydrate_result(data, parsed)
+    parsed["usage"] = token_usage.record(usage)
+    return parsed
+
+# Refinements send the model only the new text plus the current search, so every round
+# costs about the same however long the session has been going.
+REFINE_PROMPT_TEMPLATE = """
+You update an existing property search with a refinement from the user. The current search
+and the relevant rows of the filter catalog are listed below.
+
+From the refinement at the end, please return only what changes:
+1. "add_city": cities the refinement adds. "remove_city": cities it removes.
+2. "filters": each filter the refinement adds or changes, as the catalog row_id plus its "value"
+   (the numeric range [min, max] or single value [value]). Use the current row_id to change an existing filter.
+3. "remove_filters": row_ids of current filters the refinement removes.
+
+IMPORTANT:
+- row_id must be copied exactly from the current search or the catalog.
+- If the row's search_type is 'min_max', handle numeric min/max. Use null for a bound the refinement does not mention.
+- If the row's search_type is "Yes/No", set 'value' to 'True' for yes and 'False' for no
+- Leave out anything the refinement does not change.
+
+Return a JSON object with the following structure (valid JSON only):
+
+{{
+  "add_city": [ ... ],
+  "remove_city": [ ... ],
+  "filters": [
+    {{"row_id": "...", "value": [...]}}
+  ],
+  "remove_filters": [ ... ]
+}}
+
+{catalog_intro}
+{context_text}
+
+Current search (filters as row_id|filter_name|value):
+{state_text}
+
+Refinement: "{refinement}"
+""".strip()
+
+def encode_search_state(data, prior):
+    """The current search as a few compact lines: the cities, then one row_id|filter_name|value line per filter."""
+    row_ids = get_row_id_index(data)
+    lines = ["city: " + (", ".join(prior.get("city") or []) or "(none)")]
+    for item in prior.get("filters") or []:
+        row = row_ids.resolve(item)
+        if row:
+            lines.append(f"{row_ids.id_for(row)}|{row['filter_name']}|{json.dumps(item.get('value'))}")
+    return "\n".join(lines)
+
+def build_refine_prompt(data, prior, refinement, top_k=RETRIEVAL_TOP_K, encoding=CATALOG_ENCODING):
+    candidates = get_catalog_index(data).search(refinement, top_k=top_k)
+    row_ids = get_row_id_index(data)
+    return REFINE_PROMPT_TEMPLATE.format(
+        catalog_intro=CATALOG_INTROS[encoding],
+        context_text=encode_catalog(candidates, [row_ids.id_for(row) for row in candidates], encoding),
+        state_text=encode_search_state(data, prior),
+        refinement=refinement
+    )
+
+def merge_refinement(prior, changes):
+    """
+    Applies a refinement to the prior {"city", "filters"} result and returns the new one.
+    changes holds "add_city"/"remove_city" lists, full "filters" objects and the
+    "remove_filters" names. A filter that is already present is overridden in place; for
+    min_max filters a null bound keeps the prior bound ("no more than 200" keeps "at least 100"),
+    unless that would leave low > high: then the prior bound is dropped ("at least 300" on
+    [100, 200] gives [300, None]).
+    """
+    removed_cities = {str(c).lower() for c in changes.get("remove_city") or []}
+    cities = [c for c in prior.get("city") or [] if str(c).lower() not in removed_cities]
+    for city in changes.get("add_city") or []:
+        if str(city).lower() not in {str(c).lower() for c in cities}:
+            cities.append(city)
+
+    removed = set(changes.get("remove_filters") or [])
+    filters = [dict(f) for f in prior.get("filters") or [] if f.get("filter_name") not in removed]
+    by_name = {f["filter_name"]: f for f in filters}
+    for item in changes.get("filters") or []:
+        current = by_name.get(item["filter_name"])
+        if current is None:
+            by_name[item["filter_name"]] = dict(item)
+            filters.append(by_name[item["filter_name"]])
+            continue
+        value = item.get("value")
+        old = current.get("value")
+        if item.get("search_type") == "min_max" and isinstance(value, list) and isinstance(old, list) and len(value) == len(old) == 2:
+            merged = [new if new is not None else prior_bound for new, prior_bound in zip(value, old)]
+            try:
+                inverted = None not in merged and merged[0] > merged[1]
+            except TypeError:
+                inverted = False
+            value = value if inverted else merged  # an inverted range drops the stale prior bound
+        current["value"] = value
+    return {"city": cities, "filters": filters}
+
+def refine_with_openai(data, prior, refinement, top_k=RETRIEVAL_TOP_K, rate_limiter=None, upstream_gate=None):
+    """
+    Asks the model what the refinement changes about the prior result and merges that in
+    locally. The model's row ids are hydrated the same way as in parse_request_with_openai.
+    """
+    with tracer.span("parse.prompt_build"):
+        prompt = build_refine_prompt(data, prior, refinement, top_k)
+    if rate_limiter:
+        with tracer.span("parse.rate_limit_wait"):
+            rate_limiter.acquire()
+    with upstream_gate or contextlib.nullcontext(), tracer.span("parse.llm"):
+        response = create_completion(
+            upstream_gate,
+            model=OPENAI_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.2,
+            response_format={"type": "json_object"}
+        )
+    with tracer.span("parse.json"):
+        delta = json.loads(response.choices[0].message.content)
+        row_ids = get_row_id_index(data)
+        removed = []
+        for row_id in delta.get("remove_filters") or []:
+            row = row_ids.resolve({"row_id": row_id} if not isinstance(row_id, dict) else row_id)
+            if row:
+                removed.append(row["filter_name"])
+        changes = {
+            "add_city": delta.get("add_city") or [],
+            "remove_city": delta.get("remove_city") or [],
+            "filters": hydrate_result(data, delta)["filters"],
+            "remove_filters": removed
+        }
+        merged = merge_refinement(prior, changes)
+    merged["usage"] = token_usage.record(response.usage)
+    return merged
+
+def process_refinement(data, prior, refinement, rate_limiter=None, verbose=True, upstream_gate=None):
+    """
+    Refines a previous process_user_input result with only the new text. Plain additions
+    ("with at least 100 units", "in Dallas") are read by the fast path and merged without
+    a model call; anything else goes to refine_with_openai. Returns the merged result.
+    """
+    prior = {"city": prior.get("city") or [], "filters": prior.get("filters") or []}
+    with tracer.span("refine.total"):
+        with tracer.span("parse.fast_path"):
+            added = get_fast_path_parser(data).parse(refinement) if FAST_PATH_ENABLED else None
+        if added:
+            parsed_data = merge_refinement(prior, {"add_city": added["city"], "filters": added["filters"]})
+            parsed_data["parsed_by"] = "fast_path"
+        else:
+            cache = get_parse_cache() if PARSE_CACHE_ENABLED else None
+            with tracer.span("parse.cache_lookup"):
+                cache_key = cache.make_key(data, "refine\n" + encode_search_state(data, prior) + "\n" + refinement) if cache else None
+                parsed_data = cache.get(cache_key) if cache else None
+            if parsed_data:
+                parsed_data["parsed_by"] = "cache"
+            else:
+                parsed_data = refine_with_openai(
+                    data, prior, refinement, rate_limiter=rate_limiter, upstream_gate=upstream_gate
+                )
+                if cache:
+                    cache.put(cache_key, {k: v for k, v in parsed_data.items() if k != "usage"})
+                parsed_data["parsed_by"] = "openai"
+
+    parsed_data["catalog_version"] = getattr(data, "version", None)
+    if verbose:
+        print(json.dumps(parsed_data, indent=2))
+    return parsed_data
+
+# Micro-batching: under load, requests that arrive within BATCH_WINDOW_SECONDS of each other
+# are parsed in one completion that shares a single copy of the catalog context.
+BATCHING_ENABLED = False  # opt-in; streamed parses (on_filter/on_city) are never batched
+BATCH_WINDOW_SECONDS = 0.03
+BATCH_MAX_SIZE = 8
+
+BATCH_PROMPT_TEMPLATE = """
+You map several property search requests onto rows of the filter catalog listed below.
+
+For each request at the end (one JSON object per line, with an "id"), please perform the following tasks:
+1. Extract all city names mentioned in that request.
+2. Extract each filter mentioned in it.
+3. "value": the numeric range (e.g., [min, max]) or single value extracted (e.g., [value]).
+4. Search the catalog to find the row that most closely matches each filter and return its row_id.
+
+IMPORTANT:
+- Parse every request on its own. Never carry cities or filters over from another request.
+- row_id must be copied exactly from the catalog. Do not return any other catalog columns.
+- If the row's search_type is 'min_max', handle numeric min/max. Use null if no lower or upper bound is mentioned.
+- If the row's search_type is "Yes/No", set 'value' to 'True' for yes and 'False' for no
+- If the user references something relevant (like 'University of Texas'), place it in 'value'.
+- A request without constraints gets its cities and an empty "filters" array.
+
+Return a JSON object with one entry per request id (valid JSON only):
+
+{{
+  "results": [
+    {{"id": "...", "city": [ ... ], "filters": [ {{"row_id": "...", "value": [...]}} ]}}
+  ]
+}}
+
+{catalog_intro}
+{context_text}
+
+Requests (one JSON object per line):
+{requests_text}
+""".strip()
+
+def build_batch_prompt(data, requests, top_k=RETRIEVAL_TOP_K, encoding=CATALOG_ENCODING):
+    """One prompt for several requests; the catalog context is the union of each request's top-k rows."""
+    index = get_catalog_index(data)
+    candidates = {}
+    for request in requests:
+        for row in index.search(request, top_k=top_k):
+            candidates.setdefault(id(row), row)
+    rows = list(candidates.values())
+    row_ids = get_row_id_index(data)
+    requests_text = "\n".join(json.dumps({"id": f"q{i}", "request": request}) for i, request in enumerate(requests, 1))
+    return BATCH_PROMPT_TEMPLATE.format(
+        catalog_intro=CATALOG_INTROS[encoding],
+        context_text=encode_catalog(rows, [row_ids.id_for(row) for row in rows], encoding),
+        requests_text=requests_text
+    )
+
+def parse_batch_with_openai(data, requests, top_k=RETRIEVAL_TOP_K, rate_limiter=None, upstream_gate=None):
+    """
+    Parses several requests in one completion. Returns one result per request, or None for
+    a request the model's answer leaves out or garbles. Each result's "usage" is its share
+    of the call's tokens.
+    """
+    with tracer.span("parse.prompt_build"):
+        prompt = build_batch_prompt(data, requests, top_k)
+    if rate_limiter:
+        with tracer.span("parse.rate_limit_wait"):
+            rate_limiter.acquire()
+    with upstream_gate or contextlib.nullcontext(), tracer.span("parse.llm_batch"):
+        response = create_completion(
+            upstream_gate,
+            model=OPENAI_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.2,
+            response_format={"type": "json_object"}
+        )
+    usage = token_usage.record(response.usage)
+    share = dict({k: round(v / len(requests), 1) for k, v in usage.items()}, batch_size=len(requests)) if usage else None
+    results = []
+    with tracer.span("parse.json"):
+        answer = json.loads(response.choices[0].message.content)
+        entries = {str(e.get("id")): e for e in answer.get("results") or [] if isinstance(e, dict)}
+        for i in range(1, len(requests) + 1):
+            entry = entries.get(f"q{i}")
+            if entry is None or not isinstance(entry.get("filters", []), list) or not isinstance(entry.get("city", []), list):
+                results.append(None)
+                continue
+            parsed = hydrate_result(data, entry)
+            parsed["usage"] = share
+            results.append(parsed)
+    return results
+
+def run_parse_batch(items):
+    """MicroBatcher callback; items are (data, request, cities, rate_limiter, upstream_gate)."""
+    results = [None] * len(items)
+    groups = {}
+    for i, item in enumerate(items):
+        groups.setdefault(id(item[0]), []).append(i)  # a catalog reload can split a batch
+    for indexes in groups.values():
+        data, _, _, rate_limiter, upstream_gate = items[indexes[0]]
+        if len(indexes) == 1:
+            _, request, cities, _, _ = items[indexes[0]]
+            results[indexes[0]] = parse_request_with_openai(
+                data, request, rate_limiter=rate_limiter, upstream_gate=upstream_gate, cities=cities
+            )
+            continue
+        parsed = parse_batch_with_openai(data, [items[i][1] for i in indexes], rate_limiter=rate_limiter,
+                                         upstream_gate=upstream_gate)
+        for i, result in zip(indexes, parsed):
+            if result is not None and items[i][2] is not None:
+                result["city"] = items[i][2]
+            results[i] = result
+    return results
+
+_parse_batcher = None
+
+def get_parse_batcher():
+    """The shared MicroBatcher for parse requests, created on first use with the BATCH_* settings."""
+    global _parse_batcher
+    if _parse_batcher is None:
+        with _lazy_lock:
+            if _parse_batcher is None:
+                _parse_batcher = MicroBatcher(run_parse_batch, BATCH_WINDOW_SECONDS, BATCH_MAX_SIZE)
+    return _parse_batcher
@@ -0,0 +1,494 @@
+"""
+Local SQLite property store and the search stage that runs after process_user_input.
+
+    store = PropertyStore()
+    page = store.search(data, result, page_size=50)       # result from process_user_input
+    page = store.search(data, result, after=page["next_after"])
+
+compile_search() turns a {"city", "filters"} result into one parameterized query:
+min_max filters become range predicates, Yes/No filters become 0/1 predicates and the
+other search types become IN lists. property_attributes is the base table. Every other
+table the filters name is joined on its TABLE_LINKS key: location_metrics once per metric
+(it is a metric_name/value table), loan_records through EXISTS so that a property with
+several loans is listed once. Results are paged by property_id (keyset paging), so later
+pages cost the same as the first.
+
+The schema and indexes come from the catalog. Each table gets the columns filter_data.xlsx
+refers to, typed by search_type, and every filtered column gets an index. Load real data
+with the loader, or generate a synthetic store for benchmarking:
+
+    python property_store.py generate --properties 1000000
+    python property_store.py load property_attributes properties.csv
+    python property_store.py bench
+    python property_store.py search "Properties in Austin with at least 100 units"
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+
+STORE_PATH = "property_store.sqlite"
+STORE_PAGE_SIZE = 50
+STORE_BATCH_SIZE = 10000
+BASE_TABLE = "property_attributes"
+# How each table joins to property_attributes: (property column, table column, one property has many rows).
+TABLE_LINKS = {
+    "location_metrics": ("zip", "zip", False),
+    "university_stats_by_zip": ("zip", "zip", False),
+    "loan_records": ("property_id", "property_id", True),
+}
+DEFAULT_LINK = ("property_id", "property_id", True)
+BASE_COLUMNS = {
+    "property_id": "INTEGER PRIMARY KEY",
+    "property_name": "TEXT",
+    "city": "TEXT COLLATE NOCASE",
+    "state": "TEXT",
+    "zip": "TEXT",
+}
+TEXT_TYPE = "TEXT COLLATE NOCASE"
+IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+# "biggest_owner where is_owner_searchable = true": a column plus a fixed condition on another column.
+COLUMN_SPEC = re.compile(r"^\s*(\w+)(?:\s+where\s+(\w+)\s*=\s*(\w+)\s*)?$", re.IGNORECASE)
+
+def quote(name):
+    if not IDENTIFIER.match(str(name)):
+        raise ValueError(f"not a valid column or table name: {name!r}")
+    return '"' + name + '"'
+
+def parse_column(spec):
+    """(column, [(condition column, value)]) for a catalog column_name."""
+    match = COLUMN_SPEC.match(str(spec))
+    if not match:
+        raise ValueError(f"unsupported column_name: {spec!r}")
+    column, extra, literal = match.groups()
+    if not extra:
+        return column, []
+    value = {"true": 1, "false": 0}.get(literal.lower(), literal)
+    return column, [(extra, value)]
+
+def is_date_column(column):
+    return column.endswith("_date")
+
+def column_type(column, search_type):
+    if search_type == "min_max":
+        return "TEXT" if is_date_column(column) else "REAL"
+    if search_type == "Yes/No":
+        return "INTEGER"
+    return TEXT_TYPE
+
+def store_schema(data):
+    """{table: {column: SQL type}} covering every column the catalog can filter on."""
+    tables = {BASE_TABLE: dict(BASE_COLUMNS)}
+    for row in data:
+        table = row["table_name"]
+        link = TABLE_LINKS.get(table, DEFAULT_LINK)
+        columns = tables.setdefault(table, {})
+        if table != BASE_TABLE:
+            columns.setdefault(link[1], "INTEGER" if link[1] == "property_id" else "TEXT")
+        column, conditions = parse_column(row["column_name"])
+        if row.get("column_value") is not None:
+            # metric_name/value table: column_name holds the metric, field_name its value
+            columns.setdefault(column, TEXT_TYPE)
+            columns.setdefault(row["field_name"], "REAL")
+        else:
+            columns.setdefault(column, column_type(column, row["search_type"]))
+        for extra, value in conditions:
+            columns.setdefault(extra, "INTEGER" if isinstance(value, int) else TEXT_TYPE)
+    return tables
+
+def store_indexes(data):
+    """(table, columns) pairs to index: join keys plus every catalog column."""
+    indexes = {(BASE_TABLE, ("city",)), (BASE_TABLE, ("zip",))}
+    for row in data:
+        table = row["table_name"]
+        column, _ = parse_column(row["column_name"])
+        if table != BASE_TABLE:
+            link = TABLE_LINKS.get(table, DEFAULT_LINK)
+            indexes.add((table, (link[1],)))
+        if row.get("column_value") is not None:
+            indexes.add((table, (column, row["field_name"])))
+            indexes.add((table, (link[1], column)))
+        else:
+            indexes.add((table, (column,)))
+    return sorted(indexes)
+
+def bound(column, value, upper):
+    """A min_max bound for column; years given for a date column cover the whole year."""
+    if is_date_column(column) and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f"{int(value):04d}-12-31" if upper else f"{int(value):04d}-01-01"
+    return value
+
+def as_list(value):
+    return value if isinstance(value, list) else [value]
+
+def predicates(alias, column, search_type, value):
+    """(sql, params) for one filter's condition on alias.column."""
+    target = f"{alias}.{quote(column)}"
+    values = as_list(value)
+    if search_type == "min_max":
+        if len(values) == 1:
+            return f"{target} = ?", [bound(column, values[0], False)]
+        clauses, params = [], []
+        if values[0] is not None:
+            clauses.append(f"{target} >= ?")
+            params.append(bound(column, values[0], False))
+        if len(values) > 1 and values[1] is not None:
+            clauses.append(f"{target} <= ?")
+            params.append(bound(column, values[1], True))
+        return " AND ".join(clauses), params
+    if search_type == "Yes/No":
+        flag = str(values[0]).strip().lower() in ("true", "yes", "1")
+        return f"{target} = ?", [1 if flag else 0]
+    values = [v for v in values if v is not None]
+    if not values:
+        return "", []
+    return f"{target} IN ({', '.join('?' * len(values))})", [str(v) for v in values]
+
+def search_type_of(row, value):
+    """
+    The catalog search_type of a filter. Parse results only keep "min_max" (None otherwise),
+    so a filter whose catalog row cannot be found is told apart by its value.
+    """
+    if row.get("search_type"):
+        return row["search_type"]
+    return "Yes/No" if value in ("True", "False", ["True"], ["False"]) else "Multi-select"
+
+def compile_search(data, parsed, page_size=STORE_PAGE_SIZE, after=None):
+    """(sql, params) for one page of properties matching a parse result."""
+    from property_parser import get_row_id_index
+    row_ids = get_row_id_index(data)
+    select = ["p.property_id", "p.property_name", "p.city", "p.state", "p.zip"]
+    joins, where = [], []   # lists of (sql, params), in the order they appear in the query
+    shared = {}             # table -> alias of its one join (one-to-one tables)
+    exists = {}             # table -> (alias, conditions) for one-to-many tables
+    for item in parsed.get("filters") or []:
+        row = row_ids.resolve(item) or item
+        table = row["table_name"]
+        column, conditions = parse_column(row["column_name"])
+        link = TABLE_LINKS.get(table, DEFAULT_LINK)
+        if table == BASE_TABLE:
+            alias = "p"
+        elif row.get("column_value") is not None:
+            alias = f"m{len(joins)}"
+            joins.append((f"JOIN {quote(table)} {alias} ON {alias}.{quote(link[1])} = p.{quote(link[0])} "
+                          f"AND {alias}.{quote(column)} = ?", [row["column_value"]]))
+            column = row["field_name"]
+        elif not link[2]:
+            if table not in shared:
+                shared[table] = f"j{len(joins)}"
+                joins.append((f"JOIN {quote(table)} {shared[table]} ON {shared[table]}.{quote(link[1])} = p.{quote(link[0])}", []))
+            alias = shared[table]
+        else:
+            alias = exists.setdefault(table, (f"e{len(exists)}", []))[0]
+        clause = predicates(alias, column, search_type_of(row, item.get("value")), item.get("value"))
+        found = [clause] * bool(clause[0]) + [(f"{alias}.{quote(c)} = ?", [v]) for c, v in conditions]
+        if table in exists:
+            exists[table][1].extend(found)
+        else:
+            where.extend(found)
+            select.append(f"{alias}.{quote(column)} AS {quote_label(row.get('filter_name') or column)}")
+    for table, (alias, found) in exists.items():
+        link = TABLE_LINKS.get(table, DEFAULT_LINK)
+        inner = " AND ".join([f"{alias}.{quote(link[1])} = p.{quote(link[0])}"] + [sql for sql, _ in found])
+        where.append((f"EXISTS (SELECT 1 FROM {quote(table)} {alias} WHERE {inner})", [v for _, values in found for v in values]))
+    cities = [c for c in parsed.get("city") or [] if c]
+    if cities:
+        where.append((f"p.city IN ({', '.join('?' * len(cities))})", cities))
+    if after is not None:
+        where.append(("p.property_id > ?", [after]))
+    sql = f"SELECT {', '.join(dict.fromkeys(select))} FROM {quote(BASE_TABLE)} p"
+    sql += "".join(" " + join for join, _ in joins)
+    if where:
+        sql += " WHERE " + " AND ".join(clause for clause, _ in where)
+    sql += " ORDER BY p.property_id LIMIT ?"
+    params = [v for _, values in joins + where for v in values] + [page_size]
+    return sql, params
+
+def quote_label(text):
+    return '"' + str(text).replace('"', '""') + '"'
+
+def coerce(value, sql_type):
+    """A loader value (CSV text or JSON) in the column's storage type; empty cells become NULL."""
+    if value is None or value == "":
+        return None
+    if sql_type == "INTEGER" and not isinstance(value, (int, float)):
+        text = str(value).strip().lower()
+        if re.fullmatch(r"-?\d+", text):
+            return int(text)  # ids, and 0/1 flags
+        return 1 if text in ("true", "yes", "y", "t") else 0
+    if sql_type == "REAL":
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    return value
+
+class PropertyStore:
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self.local = threading.local()
+
+    def connection(self):
+        """One connection per thread, so searches from the server's workers run side by side."""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def create_schema(self, data):
+        """Creates any missing tables and columns for the catalog."""
+        conn = self.connection()
+        for table, columns in store_schema(data).items():
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({quote(table)})")}
+            if not existing:
+                body = ", ".join(f"{quote(c)} {t}" for c, t in columns.items())
+                conn.execute(f"CREATE TABLE {quote(table)} ({body})")
+                continue
+            for column, sql_type in columns.items():
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE {quote(table)} ADD COLUMN {quote(column)} {sql_type.replace(' PRIMARY KEY', '')}")
+        conn.commit()
+
+    def create_indexes(self, data):
+        """Indexes every column the catalog filters on (and the join keys), then refreshes the planner's statistics."""
+        conn = self.connection()
+        for table, columns in store_indexes(data):
+            name = quote("idx_" + table + "_" + "_".join(columns))
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {quote(table)} ({', '.join(quote(c) for c in columns)})")
+        conn.execute("ANALYZE")
+        conn.commit()
+
+    def columns(self, table):
+        return {row[1]: row[2] for row in self.connection().execute(f"PRAGMA table_info({quote(table)})")}
+
+    def load_rows(self, table, rows, batch_size=STORE_BATCH_SIZE):
+        """Inserts dicts into table in batches; keys that are not columns of the table are ignored. Returns the row count."""
+        types = self.columns(table)
+        if not types:
+            raise ValueError(f"no table {table!r} in {self.path}; run create_schema first")
+        conn = self.connection()
+        names = list(types)
+        sql = f"INSERT OR REPLACE INTO {quote(table)} ({', '.join(quote(c) for c in names)}) VALUES ({', '.join('?' * len(names))})"
+        count, batch = 0, []
+        for row in rows:
+            batch.append(tuple(coerce(row.get(c), types[c]) for c in names))
+            if len(batch) >= batch_size:
+                conn.executemany(sql, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            conn.executemany(sql, batch)
+            count += len(batch)
+        conn.commit()
+        return count
+
+    def load_file(self, table, path):
+        """Loads a .csv (with a header row) or a .jsonl file of objects into table."""
+        with open(path, newline="", encoding="utf-8") as f:
+            if path.endswith(".csv"):
+                return self.load_rows(table, csv.DictReader(f))
+            return self.load_rows(table, (json.loads(line) for line in f if line.strip()))
+
+    def search(self, data, parsed, page_size=STORE_PAGE_SIZE, after=None):
+        """
+        One page of properties matching a process_user_input result. Pass the returned
+        "next_after" back as after= for the next page; it is None on the last page.
+        """
+        sql, params = compile_search(data, parsed, page_size, after)
+        started = time.perf_counter()
+        cursor = self.connection().execute(sql, params)
+        names = [d[0] for d in cursor.description]
+        rows = [dict(zip(names, values)) for values in cursor.fetchall()]
+        return {
+            "rows": rows,
+            "next_after": rows[-1]["property_id"] if len(rows) == page_size else None,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)
+        }
+
+_property_store = None
+_property_store_lock = threading.Lock()
+
+def get_property_store():
+    """The shared PropertyStore for STORE_PATH, or None if it has not been created yet."""
+    global _property_store
+    if _property_store is None and os.path.exists(STORE_PATH):
+        with _property_store_lock:
+            if _property_store is None:
+                _property_store = PropertyStore()
+    return _property_store
+
+# Synthetic data: plausible ranges for the catalog's numeric columns, matched by name.
+SYNTHETIC_RANGES = [
+    ("year", (1900, 2024, int)), ("score", (0, 100, int)), ("rating", (1, 10, int)),
+    ("occupancy", (50, 100, float)), ("unit_count", (1, 600, int)), ("sqft", (500, 1000000, int)),
+    ("acres", (0.1, 100, float)), ("price", (100000, 200000000, int)), ("balance", (0, 100000000, int)),
+    ("rate", (2, 9, float)), ("distance", (0, 30, float)), ("months", (0, 360, int)),
+    ("ratio", (0.5, 1.5, float)), ("enrollment", (0, 80000, int)), ("rent", (500, 5000, int)),
+    ("chg", (-10, 15, float)), ("growth", (-10, 15, float)), ("diff", (-200, 800, int)),
+]
+SYNTHETIC_TEXT = {
+    "property_class": ["A", "B", "C", "D"],
+    "property_type": ["Multifamily", "Office", "Retail", "Industrial", "Mixed Use"],
+    "property_style": ["Garden", "Mid-Rise", "High-Rise", "Townhome"],
+    "interest_rate_type": ["Fixed", "Floating"],
+}
+
+def synthetic_generator(column, sql_type):
+    """A function rng -> a random value for the column, chosen once per column rather than per cell."""
+    if sql_type == "INTEGER":
+        return lambda rng: int(rng.random() < 0.2)
+    if is_date_column(column):
+        return lambda rng: f"{rng.randint(1990, 2030):04d}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+    if sql_type == "REAL":
+        low, high, kind = next((r for key, r in SYNTHETIC_RANGES if key in column), (0, 100, float))
+        if kind is int:
+            return lambda rng: rng.randint(low, high)
+        return lambda rng: round(rng.uniform(low, high), 2)
+    choices = SYNTHETIC_TEXT.get(column) or [f"{column.replace('_', ' ').title()} {n}" for n in range(1, 201)]
+    return lambda rng: rng.choice(choices)
+
+def synthetic_row(rng, generators):
+    return {column: generate(rng) for column, generate in generators.items()}
+
+def generate_synthetic_store(store, data, properties=1000000, zips_per_city=8, seed=0, progress=print):
+    """
+    Fills store with `properties` synthetic properties spread over the gazetteer's cities,
+    one row per zip and metric in location_metrics, about one loan per two properties and
+    one university row per zip. Indexes are built after loading, which is much faster.
+    """
+    from gazetteer import get_gazetteer
+    rng = random.Random(seed)
+    schema = store_schema(data)
+    store.create_schema(data)
+    conn = store.connection()
+    conn.execute("PRAGMA synchronous=OFF")
+    places = sorted((name, sorted(codes)[0]) for name, codes in get_gazetteer().states.items())
+    zips = [(f"{i:05d}", city, state) for i, (city, state) in enumerate(
+        (place for place in places for _ in range(zips_per_city)), start=10001)]
+    metrics = sorted({(row["column_value"], row["table_name"]) for row in data if row.get("column_value") is not None})
+
+    generators = {table: {c: synthetic_generator(c, t) for c, t in columns.items()} for table, columns in schema.items()}
+
+    def property_rows():
+        columns = {c: g for c, g in generators[BASE_TABLE].items() if c not in BASE_COLUMNS}
+        for property_id in range(1, properties + 1):
+            zip_code, city, state = zips[rng.randrange(len(zips))]
+            row = synthetic_row(rng, columns)
+            row.update(property_id=property_id, property_name=f"Property {property_id}", city=city, state=state, zip=zip_code)
+            yield row
+
+    def metric_rows():
+        for table_metric, table in metrics:
+            submarket_values = {}
+            for zip_code, city, _ in zips:
+                if city not in submarket_values:
+                    submarket_values[city] = round(rng.uniform(0, 100), 2)
+                yield table, {"zip": zip_code, "metric_name": table_metric, "zip_value": round(rng.uniform(0, 100), 2),
+                              "submarket_value": submarket_values[city]}
+
+    started = time.perf_counter()
+    count = store.load_rows(BASE_TABLE, property_rows())
+    progress(f"{BASE_TABLE}: {count} rows in {time.perf_counter() - started:.1f}s")
+    for table in schema:
+        if table == BASE_TABLE:
+            continue
+        started = time.perf_counter()
+        columns = generators[table]
+        if any(row["table_name"] == table and row.get("column_value") is not None for row in data):
+            rows = (row for t, row in metric_rows() if t == table)
+        elif TABLE_LINKS.get(table, DEFAULT_LINK)[1] == "zip":
+            rows = (dict(synthetic_row(rng, columns), zip=z) for z, _, _ in zips)
+        else:
+            rows = (dict(synthetic_row(rng, columns), property_id=rng.randint(1, properties)) for _ in range(properties // 2))
+        count = store.load_rows(table, rows)
+        progress(f"{table}: {count} rows in {time.perf_counter() - started:.1f}s")
+    started = time.perf_counter()
+    store.create_indexes(data)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    progress(f"indexes built in {time.perf_counter() - started:.1f}s")
+
+# Parse results to time against the store, in the shape process_user_input returns.
+BENCH_SEARCHES = [
+    ("units in one city", ["Austin"], [("Property Size (Units)", [100, 200])]),
+    ("units in three cities", ["Dallas", "Fort Worth", "Coppell"], [("Property Size (Units)", [100, None])]),
+    ("sqft range, no city", [], [("Property Size (Sqft)", [8000, 10000])]),
+    ("Section 8 and year built", ["Chicago"], [("Section 8", "True"), ("Year Built", [1990, None])]),
+    ("metric join", ["Denver"], [("Walk Score", [70, None]), ("Access to Parks (AARP)", [50, None])]),
+    ("loan EXISTS", ["Phoenix"], [("Current Loan Rate", [None, 5]), ("Interest Rate Type", ["Fixed"])]),
+    ("class and occupancy", [], [("Property Class", ["A"]), ("Occupancy (current)", [92, None])]),
+    ("university enrollment", ["Boston", "Cambridge"], [("University Student Enrollment (within 3 miles)", [20000, None])]),
+]
+
+def bench_searches(data):
+    from property_parser import make_filter
+    rows = {row["filter_name"]: row for row in data}
+    for label, cities, filters in BENCH_SEARCHES:
+        if all(name in rows for name, _ in filters):
+            yield label, {"city": cities, "filters": [make_filter(rows[name], value) for name, value in filters]}
+
+def run_bench(store, data, repeat=20, page_size=STORE_PAGE_SIZE):
+    """Times the first and second page of each BENCH_SEARCHES query; prints p50/p95 in ms."""
+    for label, parsed in bench_searches(data):
+        timings, second, rows = [], [], 0
+        for _ in range(repeat):
+            page = store.search(data, parsed, page_size)
+            timings.append(page["elapsed_ms"])
+            rows = len(page["rows"])
+            if page["next_after"] is not None:
+                second.append(store.search(data, parsed, page_size, after=page["next_after"])["elapsed_ms"])
+        timings.sort()
+        second.sort()
+        line = f"{label:<26} rows {rows:>3}  p50 {timings[len(timings) // 2]:>8.2f}ms  p95 {timings[int(len(timings) * 0.95)]:>8.2f}ms"
+        if second:
+            line += f"  page 2 p50 {second[len(second) // 2]:>8.2f}ms"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Local SQLite property store for parsed searches.")
+    parser.add_argument("--store", default=STORE_PATH, help=f"SQLite file (default: {STORE_PATH})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate = commands.add_parser("generate", help="create a synthetic store for benchmarking")
+    generate.add_argument("--properties", type=int, default=1000000)
+    generate.add_argument("--seed", type=int, default=0)
+    load = commands.add_parser("load", help="load a .csv or .jsonl file into one table")
+    load.add_argument("table")
+    load.add_argument("path")
+    bench = commands.add_parser("bench", help="time a fixed set of searches")
+    bench.add_argument("--repeat", type=int, default=20)
+    search = commands.add_parser("search", help="parse a request and print the first page of matches")
+    search.add_argument("query")
+    search.add_argument("--page-size", type=int, default=STORE_PAGE_SIZE)
+    search.add_argument("--after", type=int, help="property_id to continue after (next_after of the previous page)")
+    search.add_argument("--sql", action="store_true", help="also print the compiled SQL")
+    args = parser.parse_args()
+
+    from property_parser import get_data_list, process_user_input
+    data = get_data_list()
+    store = PropertyStore(args.store)
+    if args.command == "generate":
+        if os.path.exists(args.store):
+            parser.error(f"{args.store} already exists; remove it first")
+        generate_synthetic_store(store, data, args.properties, seed=args.seed)
+    elif args.command == "load":
+        store.create_schema(data)
+        print(f"Loaded {store.load_file(args.table, args.path)} rows into {args.table}")
+        store.create_indexes(data)
+    elif args.command == "bench":
+        run_bench(store, data, args.repeat)
+    else:
+        parsed = process_user_input(data, args.query, verbose=False)
+        if not parsed:
+            print("Error: Could not process user request.")
+            return
+        if args.sql:
+            print(compile_search(data, parsed, args.page_size, args.after))
+        print(json.dumps(store.search(data, parsed, args.page_size, args.after), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Bounded query execution shared by the GUI, bulk mode and the HTTP service.
+
+    executor = get_query_executor()
+    handle = executor.submit(process_user_input, data, text, request_id=rid, timeout=30)
+    handle.cancel()            # e.g. from the Cancel button
+    result = handle.result()   # raises QueryCancelled / QueryTimeout / the last error
+
+A fixed pool of workers runs the calls, and at most max_queue calls may wait for one.
+Beyond that, submit() raises QueryRejected, or waits when block=True. Each call has a
+deadline and is retried on transient OpenAI errors (connection problems, timeouts, rate
+limits, 5xx), with jittered exponential backoff. Cancellation is cooperative: code running
+under the executor calls check_cancelled() between stages (property_parser does so around
+the cache, the upstream gate and every streamed chunk), and remaining_time() caps the
+upstream timeout so a hung call cannot outlive the deadline.
+"""
+import contextvars
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import request_context
+
+QUERY_WORKERS = 8
+QUERY_MAX_QUEUE = 64
+QUERY_TIMEOUT_SECONDS = 45
+QUERY_MAX_RETRIES = 3
+QUERY_BACKOFF_BASE = 0.5   # seconds before the first retry (before jitter)
+QUERY_BACKOFF_MAX = 8.0
+
+class QueryCancelled(Exception):
+    pass
+
+class QueryTimeout(TimeoutError):
+    pass
+
+class QueryRejected(Exception):
+    """The executor's queue is full."""
+
+class QueryToken:
+    """Deadline and cancel flag of one submitted call; checked cooperatively by the code it runs."""
+    def __init__(self, timeout):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def cancel(self):
+        self.event.set()
+
+    def remaining(self):
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def check(self):
+        if self.event.is_set():
+            raise QueryCancelled("query was cancelled")
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise QueryTimeout("query deadline exceeded")
+
+    def sleep(self, seconds):
+        """Waits up to seconds (less if the deadline is sooner); returns early if cancelled."""
+        remaining = self.remaining()
+        if remaining is not None:
+            seconds = min(seconds, max(0.0, remaining))
+        self.event.wait(seconds)
+        self.check()
+
+current_token = contextvars.ContextVar("current_query_token", default=None)
+
+def check_cancelled():
+    """Raises QueryCancelled/QueryTimeout if the call running on this thread should stop."""
+    token = current_token.get()
+    if token is not None:
+        token.check()
+
+def remaining_time():
+    """Seconds left before the current call's deadline, or None outside the executor."""
+    token = current_token.get()
+    return token.remaining() if token is not None else None
+
+def is_retryable(error):
+    """Transient upstream failures: connection errors and timeouts, rate limits and 5xx responses."""
+    try:
+        import openai
+    except ImportError:
+        return False
+    return isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError))
+
+class QueryHandle:
+    def __init__(self, future, token):
+        self.future = future
+        self.token = token
+
+    def cancel(self):
+        """Stops a queued call from starting and asks a running one to stop at its next check."""
+        self.token.cancel()
+        self.future.cancel()
+
+    @property
+    def cancelled(self):
+        return self.token.cancelled
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+    def add_done_callback(self, fn):
+        self.future.add_done_callback(lambda future: fn(self))
+
+class QueryExecutor:
+    def __init__(self, workers=QUERY_WORKERS, max_queue=QUERY_MAX_QUEUE, timeout=QUERY_TIMEOUT_SECONDS,
+                 max_retries=QUERY_MAX_RETRIES, backoff_base=QUERY_BACKOFF_BASE, backoff_max=QUERY_BACKOFF_MAX):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query")
+        self.slots = threading.BoundedSemaphore(workers + max_queue)
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.in_flight = 0
+        self.counts = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0, "cancelled": 0, "timed_out": 0, "retries": 0}
+
+    def count(self, key, delta=1):
+        with self.lock:
+            self.counts[key] += delta
+
+    def submit(self, fn, *args, request_id=None, timeout=None, block=False, **kwargs):
+        """
+        Queues fn(*args, **kwargs) and returns a QueryHandle. timeout overrides the default
+        deadline (0 or None in both means none). Raises QueryRejected when the queue is full,
+        unless block=True.
+        """
+        if not self.slots.acquire(blocking=block):
+            self.count("rejected")
+            raise QueryRejected(f"query queue is full ({self.max_queue} waiting)")
+        token = QueryToken(timeout if timeout is not None else self.timeout)
+        with self.lock:
+            self.queued += 1
+            self.counts["submitted"] += 1
+        try:
+            future = self.pool.submit(self.run, token, request_id, fn, args, kwargs)
+        except Exception:
+            with self.lock:
+                self.queued -= 1
+            self.slots.release()
+            raise
+        future.add_done_callback(self.release_if_never_started)
+        return QueryHandle(future, token)
+
+    def release_if_never_started(self, future):
+        # run() frees the slot itself; a future cancelled while queued never gets there.
+        if future.cancelled():
+            with self.lock:
+                self.queued -= 1
+                self.counts["cancelled"] += 1
+            self.slots.release()
+
+    def run(self, token, request_id, fn, args, kwargs):
+        with self.lock:
+            self.queued -= 1
+            self.in_flight += 1
+        context_token = current_token.set(token)
+        try:
+            with request_context(request_id):
+                result = self.call_with_retries(token, fn, args, kwargs)
+            self.count("completed")
+            return result
+        except QueryCancelled:
+            self.count("cancelled")
+            raise
+        except QueryTimeout:
+            self.count("timed_out")
+            raise
+        except Exception:
+            self.count("failed")
+            raise
+        finally:
+            current_token.reset(context_token)
+            with self.lock:
+                self.in_flight -= 1
+            self.slots.release()
+
+    def call_with_retries(self, token, fn, args, kwargs):
+        attempt = 0
+        while True:
+            token.check()
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    if token.deadline is not None and time.monotonic() >= token.deadline:
+                        raise QueryTimeout("query deadline exceeded") from e
+                    raise
+            attempt += 1
+            self.count("retries")
+            # "Full jitter": anywhere between 0 and the exponential cap.
+            token.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))))
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, queue_depth=self.queued, in_flight=self.in_flight,
+                        workers=self.workers, max_queue=self.max_queue)
+
+_query_executor = None
+_query_executor_lock = threading.Lock()
+
+def get_query_executor():
+    """The process-wide QueryExecutor with the default settings."""
+    global _query_executor
+    if _query_executor is None:
+        with _query_executor_lock:
+            if _query_executor is None:
+                _query_executor = QueryExecutor()
+    return _query_executor
@@ -0,0 +1,128 @@
+"""
+Append-only, crash-safe journal of the GUI's responses.
+
+Each result is queued by append() and written as one JSON line by a background thread.
+The thread batches whatever arrives within JOURNAL_FLUSH_SECONDS, then flushes and fsyncs
+once per batch, so a crash loses at most that last batch. When responses.jsonl grows past
+JOURNAL_MAX_BYTES, it is rotated to responses.jsonl.1 (then .2, ... up to JOURNAL_KEEP_FILES).
+Nothing is kept in memory: iter_records() reads the results back from disk, and export()
+writes them out as the old all_responses.json list. A failed write is reported and the
+thread carries on, so flush() and export() never wait on a dead writer.
+"""
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+JOURNAL_PATH = "responses.jsonl"
+JOURNAL_MAX_BYTES = 10 * 1024 * 1024
+JOURNAL_KEEP_FILES = 5
+JOURNAL_FLUSH_SECONDS = 0.5
+_CLOSE = object()
+
+class ResponseJournal:
+    def __init__(self, path=JOURNAL_PATH, max_bytes=JOURNAL_MAX_BYTES, keep_files=JOURNAL_KEEP_FILES,
+                 flush_seconds=JOURNAL_FLUSH_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.keep_files = keep_files
+        self.flush_seconds = flush_seconds
+        self.session = uuid.uuid4().hex[:12]
+        self.queue = queue.Queue()
+        self.written = 0
+        self.file = open(path, "a", encoding="utf-8")
+        self.thread = threading.Thread(target=self.write_loop, name="response-journal", daemon=True)
+        self.thread.start()
+
+    def append(self, result):
+        """Queues one result for the journal; returns immediately."""
+        record = {"ts": round(time.time(), 3), "session": self.session, "result": result}
+        self.queue.put(json.dumps(record) + "\n")
+
+    def write_loop(self):
+        closing = False
+        while not closing:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_seconds
+            while batch[-1] is not _CLOSE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            closing = batch[-1] is _CLOSE
+            lines = [line for line in batch if line is not _CLOSE]
+            try:
+                if lines:
+                    self.file.writelines(lines)
+                    self.file.flush()
+                    os.fsync(self.file.fileno())
+                    self.written += len(lines)
+                    if self.file.tell() >= self.max_bytes:
+                        self.rotate()
+            except Exception as e:
+                print(f"Could not write to {self.path}: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+        self.file.close()
+
+    def rotate(self):
+        """responses.jsonl -> .1 -> .2 ...; the oldest file beyond keep_files is deleted."""
+        self.file.close()
+        try:
+            oldest = f"{self.path}.{self.keep_files}"
+            if os.path.exists(oldest):
+                os.remove(oldest)
+            for n in range(self.keep_files - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{n}"):
+                    os.replace(f"{self.path}.{n}", f"{self.path}.{n + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        finally:
+            self.file = open(self.path, "a", encoding="utf-8")  # even a failed rotation keeps journaling
+
+    def flush(self):
+        """Blocks until everything appended so far is on disk."""
+        self.queue.join()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(_CLOSE)
+            self.thread.join()
+
+    def files(self):
+        """Journal files from oldest to newest."""
+        rotated = [f"{self.path}.{n}" for n in range(self.keep_files, 0, -1)]
+        return [path for path in rotated + [self.path] if os.path.exists(path)]
+
+    def iter_records(self, session=None):
+        """Yields journal records oldest first, optionally only one session's. A line cut short by a crash is skipped."""
+        self.flush()
+        for path in self.files():
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if session is None or record.get("session") == session:
+                        yield record
+
+    def export(self, path="all_responses.json", session=None):
+        """
+        Writes the journaled results as a JSON list (the old all_responses.json format),
+        streaming from disk. Returns the number of results written.
+        """
+        count = 0
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("[")
+            for record in self.iter_records(session):
+                f.write(",\n" if count else "\n")
+                f.write(json.dumps(record["result"], indent=4))
+                count += 1
+            f.write("\n]\n" if count else "]\n")
+        return count
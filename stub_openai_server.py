@@ -0,0 +1,241 @@
+"""
+Local stand-in for the OpenAI Chat Completions API, for tests and benchmarks without
+network access or API spend. Point the client at it with OPENAI_BASE_URL:
+
+    python stub_openai_server.py --port 8089 --latency 0.8 &
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=stub python parse_server.py
+
+Every completion returns the same JSON reply (an empty parse unless --reply-file is
+given) after --latency seconds, plus or minus up to --jitter seconds; "stream": true requests get it as server-sent events
+spread over the same latency. With --error-rate, that fraction of completions fails with
+a 503 instead, to exercise retries. With --slow-rate, that fraction stalls for --slow-latency
+seconds before answering at all (like a request stuck in an upstream queue), to exercise
+hedging. A batched parse prompt (one {"id": ..., "request": ...} line per request) gets
+the reply once per id under "results", and --batch-item-latency adds time per extra
+request in the batch. GET /stats reports how many completions were served, and how many
+streams the client closed before the end.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = {"city": [], "filters": []}
+STREAM_PIECES = 20  # chunks per streamed completion
+BATCH_ID_PATTERN = re.compile(r'^\{"id": "([^"]+)", "request":', re.MULTILINE)
+
+class StubState:
+    def __init__(self, reply=None, latency=0.0, jitter=0.0, seed=None, error_rate=0.0, slow_rate=0.0, slow_latency=0.0,
+                 batch_item_latency=0.0):
+        self.reply = reply if reply is not None else DEFAULT_REPLY
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.batch_item_latency = batch_item_latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.completions = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.prompt_bytes = 0
+        self.errors = 0
+        self.slow = 0
+        self.batched_requests = 0
+        self.closed_early = 0
+
+    def should_fail(self):
+        with self.lock:
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.errors += 1
+                return True
+            return False
+
+    def begin(self, prompt):
+        with self.lock:
+            self.completions += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.prompt_bytes += len(prompt.encode("utf-8"))
+            stall = 0.0
+            if self.slow_rate and self.random.random() < self.slow_rate:
+                self.slow += 1
+                stall = self.slow_latency
+            return stall, max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def end(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "completions": self.completions,
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "prompt_bytes": self.prompt_bytes,
+                "errors": self.errors,
+                "slow": self.slow,
+                "batched_requests": self.batched_requests,
+                "closed_early": self.closed_early
+            }
+
+def usage_body(content, prompt):
+    prompt_tokens = max(1, len(prompt) // 4)  # rough chars-per-token estimate
+    completion_tokens = max(1, len(content) // 4)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+
+def completion_body(content, prompt):
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "stub",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": usage_body(content, prompt)
+    }
+
+def chunk_body(delta, finish_reason):
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": "stub",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self.send_json(200, self.server.state.stats())
+        else:
+            self.send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+        state = self.server.state
+        if state.should_fail():
+            self.send_json(503, {"error": {"message": "stub: injected failure", "type": "server_error"}})
+            return
+        prompt = "".join(m.get("content") or "" for m in body.get("messages", []))
+        stall, latency = state.begin(prompt)
+        try:
+            time.sleep(stall)
+            ids = BATCH_ID_PATTERN.findall(prompt)
+            if ids:
+                with state.lock:
+                    state.batched_requests += len(ids)
+                latency += state.batch_item_latency * (len(ids) - 1)
+                content = json.dumps({"results": [dict(state.reply, id=i) for i in ids]}, indent=2)
+            else:
+                content = json.dumps(state.reply, indent=2)
+            if body.get("stream"):
+                include_usage = (body.get("stream_options") or {}).get("include_usage")
+                try:
+                    self.send_stream(content, latency, prompt if include_usage else None)
+                except (BrokenPipeError, ConnectionResetError):
+                    with state.lock:
+                        state.closed_early += 1  # the client closed the stream early (e.g. a cancelled query)
+            else:
+                time.sleep(latency)
+                try:
+                    self.send_json(200, completion_body(content, prompt))
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client gave up waiting (e.g. its deadline passed)
+        finally:
+            state.end()
+
+    def send_stream(self, content, latency, usage_prompt=None, pieces=STREAM_PIECES):
+        """Server-sent events like the real API, spreading the latency evenly over the pieces."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        size = max(1, -(-len(content) // pieces))
+        for start in range(0, len(content), size):
+            time.sleep(latency / pieces)
+            self.send_event(chunk_body({"content": content[start:start + size]}, None))
+        self.send_event(chunk_body({}, "stop"))
+        if usage_prompt is not None:
+            self.send_event(dict(chunk_body({}, None), choices=[], usage=usage_body(content, usage_prompt)))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def send_event(self, payload):
+        self.wfile.write(b"data: " + json.dumps(payload).encode("utf-8") + b"\n\n")
+        self.wfile.flush()
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # benchmarks open many connections at once
+
+def make_stub_server(host="127.0.0.1", port=0, reply=None, latency=0.0, jitter=0.0, seed=None, error_rate=0.0,
+                     slow_rate=0.0, slow_latency=0.0, batch_item_latency=0.0):
+    server = StubHTTPServer((host, port), StubHandler)
+    server.state = StubState(reply, latency, jitter, seed, error_rate, slow_rate, slow_latency, batch_item_latency)
+    server.base_url = f"http://{host}:{server.server_address[1]}/v1"
+    return server
+
+def start_stub_server(host="127.0.0.1", port=0, reply=None, latency=0.0, jitter=0.0, seed=None, error_rate=0.0,
+                      slow_rate=0.0, slow_latency=0.0, batch_item_latency=0.0):
+    """Starts the stub in a daemon thread and returns the server; server.base_url is ready for OpenAI(base_url=...)."""
+    server = make_stub_server(host, port, reply, latency, jitter, seed, error_rate, slow_rate, slow_latency,
+                              batch_item_latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stub of the OpenAI Chat Completions API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before each completion")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform +/- seconds added to each latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of completions answered with a 503")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of completions stalled for --slow-latency first")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="seconds a slow completion stalls")
+    parser.add_argument("--batch-item-latency", type=float, default=0.0,
+                        help="seconds added per extra request in a batched prompt")
+    parser.add_argument("--reply-file", help="JSON file with the parse every completion returns")
+    args = parser.parse_args()
+    reply = None
+    if args.reply_file:
+        with open(args.reply_file) as f:
+            reply = json.load(f)
+    server = make_stub_server(args.host, args.port, reply, args.latency, args.jitter, error_rate=args.error_rate,
+                              slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                              batch_item_latency=args.batch_item_latency)
+    print(f"Stub OpenAI API listening on {server.base_url}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
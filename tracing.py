@@ -0,0 +1,141 @@
+"""
+Lightweight per-stage latency tracing.
+
+Code marks stages with `with tracer.span("parse.llm"):`. Spans are attributed to the
+request id bound for the current thread or task (`with request_context(rid):`), kept per
+request for the most recent requests, and folded into rolling per-stage windows that
+report p50/p95/p99. Work done for several requests at once (a micro-batch) binds a tuple
+of request ids, and its spans are kept for each of them. When the tracer is disabled,
+span() returns a shared no-op object.
+"""
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+TRACE_WINDOW = 1000        # recent durations kept per stage for percentiles
+TRACE_MAX_REQUESTS = 500   # recent requests whose individual spans are kept
+TRACE_PATH = "latency_trace.json"
+
+current_request_id = contextvars.ContextVar("current_request_id", default=None)
+_request_counter = itertools.count(1)
+
+def new_request_id():
+    return f"{os.getpid()}-{int(time.time())}-{next(_request_counter)}"
+
+class request_context:
+    """Binds a request id (a new one by default) to the current thread or asyncio task."""
+    def __init__(self, request_id=None):
+        self.request_id = request_id if request_id is not None else new_request_id()
+        self.token = None
+
+    def __enter__(self):
+        self.token = current_request_id.set(self.request_id)
+        return self.request_id
+
+    def __exit__(self, *exc):
+        current_request_id.reset(self.token)
+        return False
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ("tracer", "stage", "request_id", "start")
+
+    def __init__(self, tracer, stage, request_id):
+        self.tracer = tracer
+        self.stage = stage
+        self.request_id = request_id
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.stage, time.perf_counter() - self.start, self.request_id, self.start)
+        return False
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+class Tracer:
+    def __init__(self, enabled=True, window=TRACE_WINDOW, max_requests=TRACE_MAX_REQUESTS):
+        self.enabled = enabled
+        self.window = window
+        self.max_requests = max_requests
+        self.lock = threading.Lock()
+        self.durations = {}          # stage -> deque of recent durations (seconds)
+        self.counts = {}             # stage -> total spans ever recorded
+        self.requests = OrderedDict()  # request id -> [span dicts]
+        self.origin = time.perf_counter()
+
+    def span(self, stage, request_id=None):
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, stage, request_id if request_id is not None else current_request_id.get())
+
+    def record(self, stage, seconds, request_id=None, start=None):
+        """Records a duration measured elsewhere, e.g. a wait that spans two threads."""
+        if not self.enabled:
+            return
+        with self.lock:
+            window = self.durations.get(stage)
+            if window is None:
+                window = self.durations[stage] = deque(maxlen=self.window)
+            window.append(seconds)
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+            if request_id is None:
+                return
+            span = {
+                "stage": stage,
+                "start_ms": round(((start if start is not None else time.perf_counter() - seconds) - self.origin) * 1000, 3),
+                "duration_ms": round(seconds * 1000, 3)
+            }
+            for rid in request_id if isinstance(request_id, tuple) else (request_id,):
+                spans = self.requests.get(rid)
+                if spans is None:
+                    spans = self.requests[rid] = []
+                    while len(self.requests) > self.max_requests:
+                        self.requests.popitem(last=False)
+                spans.append(span)
+
+    def stage_stats(self):
+        """{stage: {count, mean_ms, p50_ms, p95_ms, p99_ms, max_ms}} over each stage's rolling window."""
+        with self.lock:
+            windows = {stage: sorted(values) for stage, values in self.durations.items()}
+            counts = dict(self.counts)
+        stats = {}
+        for stage, values in sorted(windows.items()):
+            stats[stage] = {
+                "count": counts[stage],
+                "mean_ms": round(sum(values) / len(values) * 1000, 3),
+                "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+                "max_ms": round(values[-1] * 1000, 3)
+            }
+        return stats
+
+    def snapshot(self):
+        with self.lock:
+            requests = {rid: list(spans) for rid, spans in self.requests.items()}
+        return {"stages": self.stage_stats(), "requests": requests}
+
+    def dump(self, path=TRACE_PATH):
+        with open(path, "w") as f:
+            json.dump(self.snapshot(), f, indent=4)
+
+tracer = Tracer(enabled=os.environ.get("CHATBOT_TRACE", "1") != "0")
@@ -0,0 +1,183 @@
+"""
+Shared voice capture for the GUI.
+
+A Speak session runs three stages at once: the capture loop keeps calling listen() on the
+microphone, each captured phrase is handed to a small pool of recognizer threads, and the
+transcripts are put back together in capture order. Speech that arrives while an earlier
+phrase is still being recognized is no longer lost or delayed.
+
+The microphone's ambient-noise threshold is measured once and saved to
+voice_calibration.json, so later sessions (and later runs) start listening straight away.
+
+The recognizer backend is a plain callable (recognizer, audio) -> text, so the pipeline
+can be run offline on WAV files with transcribe_file() and a stub or local backend.
+"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import request_context, tracer
+
+VOICE_WORKERS = 3                      # phrases recognized in parallel
+VOICE_CALIBRATION_PATH = "voice_calibration.json"
+VOICE_CALIBRATION_SECONDS = 1
+VOICE_CALIBRATION_MAX_AGE = 24 * 3600  # re-measure ambient noise after this many seconds
+LISTEN_TIMEOUT = 5
+PHRASE_TIME_LIMIT = 5
+VOICE_SERVICE_ERROR = "Error connecting to the speech recognition service."
+
+def google_backend(recognizer, audio):
+    return recognizer.recognize_google(audio)
+
+class TranscriptAssembler:
+    """
+    Collects recognized phrases by capture sequence number and reports the transcript so
+    far whenever the next phrase in order is available. A phrase that finishes early
+    waits for the ones captured before it.
+    """
+    def __init__(self, on_text=None):
+        self.on_text = on_text
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.next_seq = 0
+        self.parts = []
+
+    def add(self, seq, text):
+        with self.lock:
+            self.pending[seq] = text
+            changed = False
+            while self.next_seq in self.pending:
+                piece = self.pending.pop(self.next_seq)
+                self.next_seq += 1
+                if piece:
+                    self.parts.append(piece)
+                    changed = True
+            # Reported under the lock so two workers cannot deliver transcripts out of order.
+            if changed and self.on_text:
+                self.on_text(" ".join(self.parts))
+
+    @property
+    def text(self):
+        with self.lock:
+            return " ".join(self.parts)
+
+class VoiceEngine:
+    """One recognizer, recognizer pool and calibration cache shared by every Speak button."""
+    def __init__(self, backend=google_backend, workers=VOICE_WORKERS, calibration_path=VOICE_CALIBRATION_PATH):
+        self.backend = backend
+        self.workers = workers
+        self.calibration_path = calibration_path
+        self.recognizer = None
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def setup(self):
+        """Creates the recognizer and worker pool on first use so speech_recognition loads only for voice input."""
+        with self.lock:
+            if self.recognizer is None:
+                import speech_recognition as sr
+                self.recognizer = sr.Recognizer()
+                self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="voice")
+        return self.recognizer
+
+    def load_calibration(self):
+        try:
+            with open(self.calibration_path) as f:
+                saved = json.load(f)
+            return float(saved["energy_threshold"]), float(saved["calibrated_at"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save_calibration(self, calibrated_at):
+        try:
+            with open(self.calibration_path, "w") as f:
+                json.dump({"energy_threshold": self.recognizer.energy_threshold, "calibrated_at": calibrated_at}, f)
+        except OSError as e:
+            print(f"Could not save voice calibration: {e}")
+
+    def calibrate(self, source, force=False):
+        """
+        Uses the saved energy threshold if it is recent enough, otherwise measures ambient
+        noise for VOICE_CALIBRATION_SECONDS and saves the result. Returns the time the
+        threshold was measured.
+        """
+        saved = None if force else self.load_calibration()
+        if saved and time.time() - saved[1] < VOICE_CALIBRATION_MAX_AGE:
+            self.recognizer.energy_threshold = saved[0]
+            return saved[1]
+        with tracer.span("voice.calibrate"):
+            self.recognizer.adjust_for_ambient_noise(source, duration=VOICE_CALIBRATION_SECONDS)
+        calibrated_at = time.time()
+        self.save_calibration(calibrated_at)
+        return calibrated_at
+
+    def recognize(self, seq, audio, assembler, errors, request_id):
+        import speech_recognition as sr
+        text = ""
+        with request_context(request_id), tracer.span("voice.recognize"):
+            try:
+                text = self.backend(self.recognizer, audio)
+            except sr.UnknownValueError:
+                pass
+            except sr.RequestError:
+                errors.append(VOICE_SERVICE_ERROR)
+        assembler.add(seq, text)
+
+    def transcribe(self, source, should_continue=lambda: True, on_text=None, on_error=None, request_id=None,
+                   calibrate=True):
+        """
+        Runs the capture loop on the calling thread until should_continue() returns False,
+        the source runs out (an sr.AudioFile) or the backend reports a service error.
+        on_text gets the ordered transcript so far after each phrase. Waits for pending
+        recognitions and returns the final transcript.
+        """
+        import speech_recognition as sr
+        recognizer = self.setup()
+        assembler = TranscriptAssembler(on_text)
+        errors = []
+        futures = []
+        with request_context(request_id):
+            calibrated_at = self.calibrate(source) if calibrate else None
+            while should_continue() and not errors:
+                try:
+                    with tracer.span("voice.listen"):
+                        audio = recognizer.listen(source, timeout=LISTEN_TIMEOUT, phrase_time_limit=PHRASE_TIME_LIMIT)
+                except sr.WaitTimeoutError:
+                    continue
+                if not audio.frame_data:
+                    break  # end of an audio file
+                futures.append(self.pool.submit(self.recognize, len(futures), audio, assembler, errors, request_id))
+        for future in futures:
+            future.result()
+        if calibrated_at is not None:
+            # listen() keeps adjusting the threshold to the room; keep that for the next session.
+            self.save_calibration(calibrated_at)
+        if errors and on_error:
+            on_error(errors[0])
+        return assembler.text
+
+    def listen_microphone(self, should_continue, on_text=None, on_error=None, request_id=None):
+        import speech_recognition as sr
+        self.setup()
+        with sr.Microphone() as source:
+            return self.transcribe(source, should_continue, on_text, on_error, request_id)
+
+    def transcribe_file(self, path, on_text=None, on_error=None, request_id=None):
+        """Runs a WAV/AIFF/FLAC file through the same pipeline (no calibration), e.g. for offline tests."""
+        import speech_recognition as sr
+        self.setup()
+        with sr.AudioFile(path) as source:
+            return self.transcribe(source, on_text=on_text, on_error=on_error, request_id=request_id, calibrate=False)
+
+_voice_engine = None
+_voice_engine_lock = threading.Lock()
+
+def get_voice_engine():
+    """The VoiceEngine shared by the main window and the refine dialogs."""
+    global _voice_engine
+    if _voice_engine is None:
+        with _voice_engine_lock:
+            if _voice_engine is None:
+                _voice_engine = VoiceEngine()
+    return _voice_engine